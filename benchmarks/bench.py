@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Offline throughput benchmarks for the generate, list and bulk action paths.
+
+Each scenario starts a fresh `benchmarks.mock_server` in a subprocess, points
+the client at it and reports ops/sec, p50/p99 request latency and the peak
+Python memory allocated by the client side:
+
+    python -m benchmarks.bench --count 200 --inventory 5000 --latency 0.02
+    python -m benchmarks.bench --json baseline.json
+    python -m benchmarks.bench --compare baseline.json --tolerance 0.2
+
+`--codec` and `--loop` pick the JSON codec and event loop, `--matrix` runs the
+scenarios once per installed combination:
+
+    python -m benchmarks.bench --scenario list generate --list-format jsonl --matrix
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from rich.console import Console
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from icloud import AdaptiveRateLimiter, GenerationPipeline, HideMyEmail  # noqa: E402
+from icloud import codec  # noqa: E402
+import main  # noqa: E402
+
+
+class TimedMixin:
+    """Records the latency of every endpoint call"""
+
+    latencies: List[float]
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        start = time.perf_counter()
+        try:
+            return await super()._request(method, url, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class TimedHideMyEmail(TimedMixin, HideMyEmail):
+    pass
+
+
+class TimedRichHideMyEmail(TimedMixin, main.RichHideMyEmail):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockServer:
+    def __init__(self, args: argparse.Namespace, inventory: int):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.cmd = [
+            sys.executable,
+            "-m",
+            "benchmarks.mock_server",
+            "--port",
+            str(self.port),
+            "--latency",
+            str(args.latency),
+            "--jitter",
+            str(args.jitter),
+            "--error-rate",
+            str(args.error_rate),
+            "--inventory",
+            str(inventory),
+            "--seed",
+            "1",
+        ]
+
+    def __enter__(self) -> "MockServer":
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.proc = subprocess.Popen(
+            self.cmd, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.proc.kill()
+        raise RuntimeError("mock server did not start")
+
+    def __exit__(self, *exc) -> None:
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _limiter(args: argparse.Namespace) -> AdaptiveRateLimiter:
+    return AdaptiveRateLimiter(rate=args.rate, max_rate=args.rate)
+
+
+def _rich_client(args: argparse.Namespace, url: str) -> TimedRichHideMyEmail:
+    os.environ[main.BASE_URL_ENVVAR] = url
+    hme = TimedRichHideMyEmail("bench", "bench")
+    hme.console = Console(file=io.StringIO(), width=160)
+    hme.limiter = _limiter(args)
+    hme.latencies = []
+    return hme
+
+
+async def bench_generate(args: argparse.Namespace, url: str) -> dict:
+    async with TimedHideMyEmail(
+        "bench", "bench", limiter=_limiter(args), base_url=url
+    ) as hme:
+        hme.latencies = []
+        pipeline = GenerationPipeline(
+            hme,
+            args.count,
+            generate_concurrency=args.concurrency,
+            reserve_concurrency=args.concurrency,
+        )
+        start = time.perf_counter()
+        reserved = await pipeline.run()
+        return _result(len(reserved), time.perf_counter() - start, hme.latencies)
+
+
+async def bench_list(args: argparse.Namespace, url: str) -> dict:
+    async with _rich_client(args, url) as hme:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            hme.console = Console(file=io.StringIO(), width=160)
+            # jsonl rows go to stdout, keep them out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                await hme.list(True, None, refresh=True, fmt=args.list_format)
+        return _result(args.repeat, time.perf_counter() - start, hme.latencies)
+
+
+async def bench_bulk(args: argparse.Namespace, url: str) -> dict:
+    emails = [f"mock.{i:06d}@icloud.com" for i in range(args.inventory)]
+    async with _rich_client(args, url) as hme:
+        start = time.perf_counter()
+        results = await hme.deactivate(iter(emails), args.bulk_concurrency)
+        return _result(results["success"], time.perf_counter() - start, hme.latencies)
+
+
+def _result(ops: int, elapsed: float, latencies: List[float]) -> dict:
+    return {
+        "ops": ops,
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(ops / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "requests": len(latencies),
+    }
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "generate": bench_generate,
+    "list": bench_list,
+    "bulk": bench_bulk,
+}
+
+
+def run(args: argparse.Namespace) -> Dict[str, dict]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cookie = os.path.join(tmp, "cookie.txt")
+        with open(cookie, "w") as f:
+            f.write("X-APPLE-WEBAUTH-TOKEN=bench")
+        main.RichHideMyEmail._cookie_file = cookie
+        for name in args.scenario:
+            os.environ[main.INVENTORY_ENVVAR] = os.path.join(tmp, f"{name}.db")
+            inventory = 0 if name == "generate" else args.inventory
+            with MockServer(args, inventory) as server:
+                tracemalloc.start()
+                loop = asyncio.new_event_loop()
+                try:
+                    result = loop.run_until_complete(SCENARIOS[name](args, server.url))
+                finally:
+                    loop.close()
+                result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                tracemalloc.stop()
+            results[name] = result
+    return results
+
+
+def run_matrix(args: argparse.Namespace) -> Dict[str, dict]:
+    """Runs the scenarios per installed codec and loop, keyed `scenario[codec+loop]`"""
+    results = {}
+    # use_loop("asyncio") keeps whatever policy is installed, reset it per combination
+    policy = asyncio.get_event_loop_policy()
+    for json_name in ("json", "orjson"):
+        for loop_name in ("asyncio", "uvloop"):
+            asyncio.set_event_loop_policy(policy)
+            try:
+                codec.use_json(json_name)
+                codec.use_loop(loop_name)
+            except ImportError:
+                continue
+            for name, result in run(args).items():
+                results[f"{name}[{json_name}+{loop_name}]"] = result
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['ops_per_sec']} ops/s < baseline {base['ops_per_sec']}"
+            )
+        if result["peak_mb"] > base["peak_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['peak_mb']} MB peak > baseline {base['peak_mb']}"
+            )
+    return regressions
+
+
+def report(results: Dict[str, dict]) -> None:
+    width = max(10, *(len(name) + 2 for name in results))
+    header = f"{'scenario':<{width}}{'ops':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(
+            f"{name:<{width}}{r['ops']:>8}{r['ops_per_sec']:>10}"
+            f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['peak_mb']:>10}"
+        )
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument(
+        "--scenario",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+    )
+    p.add_argument("--count", type=int, default=200, help="aliases to generate")
+    p.add_argument("--inventory", type=int, default=2000, help="aliases in the account")
+    p.add_argument("--repeat", type=int, default=5, help="list calls")
+    p.add_argument("--concurrency", type=int, default=main.MAX_CONCURRENT_TASKS)
+    p.add_argument("--bulk-concurrency", type=int, default=main.MAX_BULK_TASKS)
+    p.add_argument("--latency", type=float, default=0.01, help="mock server latency")
+    p.add_argument("--jitter", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument(
+        "--rate",
+        type=float,
+        default=10_000,
+        help="client rate limit, high by default to measure the client itself",
+    )
+    p.add_argument(
+        "--list-format",
+        choices=("table", "jsonl", "csv"),
+        default="table",
+        help="list output, jsonl leaves out the table rendering",
+    )
+    p.add_argument("--codec", choices=codec.JSON_BACKENDS, default="auto")
+    p.add_argument("--loop", choices=codec.LOOP_BACKENDS, default="auto")
+    p.add_argument(
+        "--matrix",
+        action="store_true",
+        help="run every installed codec and loop combination",
+    )
+    p.add_argument("--json", help="write results to this file")
+    p.add_argument("--compare", help="baseline results to compare against")
+    p.add_argument("--tolerance", type=float, default=0.2)
+    return p
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    if args.matrix:
+        results = run_matrix(args)
+    else:
+        print(
+            f"codec {codec.use_json(args.codec)}, loop {codec.use_loop(args.loop)}",
+            file=sys.stderr,
+        )
+        results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Local stand-in for the iCloud HideMyEmail endpoints.
+
+Run it and point the client at it with `HME_BASE_URL`:
+
+    python -m benchmarks.mock_server --port 8787 --latency 0.05 --inventory 2000
+    HME_BASE_URL=http://127.0.0.1:8787 python cli.py list
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        inventory: int = 0,
+        quota: int = 0,
+        quota_window: float = 1800,
+        seed: Optional[int] = None,
+        cookie: str = "",
+    ):
+        """Behaviour of the mock server.
+
+        Args:
+            latency (float)         Seconds added to every response
+            jitter (float)          Extra random latency, uniform in [0, jitter]
+            error_rate (float)      Probability of a 500 response
+            rate_limit (float)      Requests per second before answering 429, 0 disables it
+            inventory (int)         Aliases present in the account at start
+            quota (int)             Reservations allowed per `quota_window`, 0 disables it
+            quota_window (float)    Seconds of the rolling reservation window
+            seed (int)              Seed for the random generator
+            cookie (str)            Answer 401 unless the Cookie header contains this, empty disables it
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.inventory = inventory
+        self.quota = quota
+        self.quota_window = quota_window
+        self.cookie = cookie
+        self.random = random.Random(seed)
+
+
+class MockHideMyEmail:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.aliases: Dict[str, dict] = {}
+        self.by_id: Dict[str, dict] = {}
+        self.generated: Dict[str, float] = {}
+        self.reservations = []
+        self.requests = 0
+        self._tokens = config.rate_limit
+        self._updated = time.monotonic()
+        now = int(time.time() * 1000)
+        for i in range(config.inventory):
+            self._add(
+                f"mock.{i:06d}@icloud.com",
+                label=f"label {i % 50}",
+                note=f"note {i}",
+                created=now - i * 60_000,
+                active=i % 7 != 0,
+            )
+
+    def _add(self, hme: str, label: str, note: str, created: int, active: bool):
+        row = {
+            "origin": "ON_DEMAND",
+            "anonymousId": uuid.uuid4().hex,
+            "domain": "",
+            "forwardToEmail": "owner@example.com",
+            "hme": hme,
+            "label": label,
+            "note": note,
+            "createTimestamp": created,
+            "isActive": active,
+            "recipientMailId": "",
+        }
+        self.aliases[hme] = self.by_id[row["anonymousId"]] = row
+        return row
+
+    @staticmethod
+    def _error(message: str, status: int = 200) -> web.Response:
+        return web.json_response(
+            {"success": False, "error": {"errorCode": "", "errorMessage": message}},
+            status=status,
+        )
+
+    def _throttled(self) -> bool:
+        if not self.config.rate_limit:
+            return False
+        now = time.monotonic()
+        self._tokens = min(
+            self.config.rate_limit,
+            self._tokens + (now - self._updated) * self.config.rate_limit,
+        )
+        self._updated = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        self.requests += 1
+        cfg = self.config
+        delay = cfg.latency + (cfg.random.uniform(0, cfg.jitter) if cfg.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if cfg.cookie and cfg.cookie not in request.headers.get("Cookie", ""):
+            return web.Response(status=401, text="Unauthorized")
+        if self._throttled():
+            return web.Response(status=429, text="Too Many Requests")
+        if cfg.error_rate and cfg.random.random() < cfg.error_rate:
+            return web.Response(status=500, text="Internal Server Error")
+        return await handler(request)
+
+    @staticmethod
+    async def _payload(request: web.Request) -> dict:
+        # the client sends JSON with a text/plain content type, like the browser does
+        text = await request.text()
+        return json.loads(text) if text else {}
+
+    async def generate(self, request: web.Request) -> web.Response:
+        hme = f"{uuid.uuid4().hex[:12]}@icloud.com"
+        self.generated[hme] = time.time()
+        return web.json_response(
+            {"success": True, "timestamp": int(time.time()), "result": {"hme": hme}}
+        )
+
+    async def reserve(self, request: web.Request) -> web.Response:
+        payload = await self._payload(request)
+        hme = payload.get("hme", "")
+        if hme not in self.generated:
+            return self._error("Email was not generated")
+        if self.config.quota:
+            now = time.time()
+            window = [
+                t for t in self.reservations if now - t < self.config.quota_window
+            ]
+            self.reservations = window
+            if len(window) >= self.config.quota:
+                return self._error(
+                    "You have reached the limit of addresses you can create at this time. Try again later."
+                )
+            self.reservations.append(now)
+        del self.generated[hme]
+        row = self._add(
+            hme,
+            label=payload.get("label") or "",
+            note=payload.get("note") or "",
+            created=int(time.time() * 1000),
+            active=True,
+        )
+        return web.json_response({"success": True, "result": {"hme": row}})
+
+    async def list(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "success": True,
+                "result": {
+                    "forwardToEmails": ["owner@example.com"],
+                    "hmeEmails": list(self.aliases.values()),
+                    "selectedForwardTo": "owner@example.com",
+                },
+            }
+        )
+
+    async def _mutate(self, request: web.Request, action: str) -> web.Response:
+        payload = await self._payload(request)
+        row = self.by_id.get(payload.get("anonymousId", ""))
+        if row is None:
+            return self._error("Email not found")
+        if action == "delete":
+            del self.aliases[row["hme"]], self.by_id[row["anonymousId"]]
+        else:
+            row["isActive"] = action == "reactivate"
+        return web.json_response({"success": True, "result": {}})
+
+    async def delete(self, request: web.Request) -> web.Response:
+        return await self._mutate(request, "delete")
+
+    async def deactivate(self, request: web.Request) -> web.Response:
+        return await self._mutate(request, "deactivate")
+
+    async def reactivate(self, request: web.Request) -> web.Response:
+        return await self._mutate(request, "reactivate")
+
+    async def update_metadata(self, request: web.Request) -> web.Response:
+        payload = await self._payload(request)
+        row = self.by_id.get(payload.get("anonymousId", ""))
+        if row is None:
+            return self._error("Email not found")
+        row["label"] = payload.get("label") or ""
+        row["note"] = payload.get("note") or ""
+        return web.json_response({"success": True, "result": {}})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_post("/v1/hme/generate", self.generate)
+        app.router.add_post("/v1/hme/reserve", self.reserve)
+        app.router.add_post("/v1/hme/delete", self.delete)
+        app.router.add_post("/v1/hme/updateMetaData", self.update_metadata)
+        app.router.add_post("/v1/hme/deactivate", self.deactivate)
+        app.router.add_post("/v1/hme/reactivate", self.reactivate)
+        app.router.add_get("/v2/hme/list", self.list)
+        return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--inventory", type=int, default=0)
+    parser.add_argument("--quota", type=int, default=0)
+    parser.add_argument("--quota-window", type=float, default=1800)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cookie", default="")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        inventory=args.inventory,
+        quota=args.quota,
+        quota_window=args.quota_window,
+        seed=args.seed,
+        cookie=args.cookie,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(
+        MockHideMyEmail(config_from_args(args)).app(), host=args.host, port=args.port
+    )
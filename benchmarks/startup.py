@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""CLI startup time, per command.
+
+Every command only imports what it needs. This starts a fresh interpreter per
+command with `-X importtime`, imports `cli` plus the modules that command loads
+and reports wall time and the heaviest top-level imports:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --json startup.json
+    python -m benchmarks.startup --compare startup.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# command -> modules it imports on top of `cli`
+COMMANDS: Dict[str, Tuple[str, ...]] = {
+    "help": (),
+    "generate": ("main",),
+    "list": ("main", "output"),
+    "remote": ("remote", "output"),
+    "serve": ("daemon",),
+    "extract": ("cookies",),
+}
+
+
+def _importtime(stderr: str) -> Dict[str, int]:
+    """Cumulative microseconds of every top-level import"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(
+    modules: Tuple[str, ...], repeat: int
+) -> Tuple[List[float], Dict[str, int]]:
+    code = "; ".join(f"import {name}" for name in ("cli",) + modules)
+    walls, imports = [], {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        walls.append(time.perf_counter() - start)
+        imports = _importtime(proc.stderr)
+    return walls, imports
+
+
+def run(args: argparse.Namespace) -> Dict[str, dict]:
+    results = {}
+    for command in args.command:
+        walls, imports = measure(COMMANDS[command], args.repeat)
+        top = sorted(imports.items(), key=lambda item: item[1], reverse=True)
+        results[command] = {
+            "wall_ms": round(statistics.median(walls) * 1000, 1),
+            "import_ms": round(sum(imports.values()) / 1000, 1),
+            "top": [[name, round(us / 1000, 1)] for name, us in top[: args.top]],
+        }
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float):
+    regressions = []
+    for command, result in results.items():
+        base = baseline.get(command)
+        if base and result["import_ms"] > base["import_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{command}: {result['import_ms']} ms of imports > baseline {base['import_ms']}"
+            )
+    return regressions
+
+
+def report(results: Dict[str, dict]) -> None:
+    header = f"{'command':<10}{'wall ms':>10}{'import ms':>12}  heaviest imports"
+    print(header)
+    print("-" * len(header))
+    for command, r in results.items():
+        top = ", ".join(f"{name} {ms}" for name, ms in r["top"])
+        print(f"{command:<10}{r['wall_ms']:>10}{r['import_ms']:>12}  {top}")
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument(
+        "--command",
+        nargs="+",
+        choices=list(COMMANDS),
+        default=list(COMMANDS),
+    )
+    p.add_argument(
+        "--repeat", type=int, default=5, help="interpreter starts per command"
+    )
+    p.add_argument("--top", type=int, default=3, help="heaviest imports to show")
+    p.add_argument("--json", help="write results to this file")
+    p.add_argument("--compare", help="baseline results to compare against")
+    p.add_argument("--tolerance", type=float, default=0.25)
+    return p
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
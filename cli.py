@@ -1,38 +1,252 @@
 #!/usr/bin/env python3
-import asyncio
 import click
-from main import generate, list, delete, deactivate, reactivate
-from cookies import CookiesManager
+from typing import Optional, Tuple
+
+# heavy modules (asyncio, rich, aiohttp, rookiepy) are imported by the commands that
+# need them, so `--help` and light commands start fast
+from icloud.cookies import CookieError
+from icloud.sinks import SINKS
+from settings import (
+    DAEMON_ENVVAR,
+    DEFAULT_PORT,
+    MAX_BULK_TASKS,
+    MAX_CONCURRENT_TASKS,
+    POOL_HIGH,
+    POOL_LOW,
+)
+
+
+def _write_metrics(path: str) -> None:
+    from main import METRICS
+
+    METRICS.write(path)
 
 
-@click.group()
-def cli():
-    pass
+class Group(click.Group):
+    def invoke(self, ctx: click.Context):
+        try:
+            return super().invoke(ctx)
+        except CookieError:
+            # already reported by the command
+            ctx.exit(1)
+
+
+@click.group(cls=Group)
+@click.option(
+    "--metrics",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write request metrics here when done, JSON for *.json, Prometheus text otherwise",
+)
+@click.option(
+    "--daemon",
+    envvar=DAEMON_ENVVAR,
+    help="Send commands to a running `serve`, e.g. http://127.0.0.1:8765 or unix:/tmp/hme.sock",
+)
+@click.pass_context
+def cli(ctx: click.Context, metrics: Optional[str], daemon: Optional[str]):
+    ctx.obj = {"daemon": daemon}
+    if metrics:
+        ctx.call_on_close(lambda: _write_metrics(metrics))
 
 
 @click.command()
 @click.option("--count", default=1, help="How many emails to generate", type=int)
-@click.option("--label", required=True, help="To set custom label")
+@click.option("--label", required=False, help="To set custom label")
 @click.option("--notes", required=False, help="To set custom notes")
-def generatecommand(count: int, label: str, notes: str):
+@click.option(
+    "--concurrency",
+    default=MAX_CONCURRENT_TASKS,
+    show_default=True,
+    help="How many generate requests to keep in flight",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--reserve-concurrency",
+    default=MAX_CONCURRENT_TASKS,
+    show_default=True,
+    help="How many reserve requests to keep in flight",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--cookies",
+    multiple=True,
+    type=click.Path(exists=True),
+    help="Cookie file or directory of cookie files, repeat to spread generation across accounts",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the last interrupted run from the journal",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(sorted(SINKS)),
+    default=None,
+    help="Output format, text by default and csv with --cookies",
+)
+@click.option(
+    "--output",
+    default=None,
+    help='File emails are appended to as they are reserved, "-" for stdout',
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Sleep through Apple's rolling quota window until the count or the lifetime cap is reached",
+)
+@click.pass_context
+def generatecommand(
+    ctx: click.Context,
+    count: int,
+    label: str,
+    notes: str,
+    concurrency: int,
+    reserve_concurrency: int,
+    cookies: Tuple[str, ...],
+    resume: bool,
+    fmt: Optional[str],
+    output: Optional[str],
+    wait: bool,
+):
     "Generate emails"
+    if cookies and resume:
+        raise click.UsageError("--resume can't be used with --cookies.")
+    if not label and not resume:
+        raise click.UsageError("Missing option '--label'.")
+    fmt = fmt or ("csv" if cookies else "text")
+    output = output or f"emails.{'txt' if fmt == 'text' else fmt}"
+    url = ctx.obj["daemon"]
+    if url and (cookies or resume or wait):
+        raise click.UsageError(
+            "--cookies, --resume and --wait can't be used with --daemon."
+        )
+    if url:
+        from remote import remote_generate
+
+        remote_generate(
+            url, count, label, notes, concurrency, reserve_concurrency, output, fmt
+        )
+        return
+    import asyncio
+    import main
+
+    main.select_loop()
     loop = asyncio.new_event_loop()
     try:
-        loop.run_until_complete(generate(count, label, notes))
+        if cookies:
+            loop.run_until_complete(
+                main.generate_sharded(
+                    count,
+                    label,
+                    notes,
+                    cookies,
+                    concurrency,
+                    reserve_concurrency,
+                    output,
+                    fmt,
+                    wait,
+                )
+            )
+        else:
+            loop.run_until_complete(
+                main.generate(
+                    count,
+                    label,
+                    notes,
+                    concurrency,
+                    reserve_concurrency,
+                    resume,
+                    output,
+                    fmt,
+                    wait,
+                )
+            )
     except KeyboardInterrupt:
         pass
 
 
+def _regex(ctx, param, value: Optional[str]) -> Optional[str]:
+    if value is not None:
+        import re
+
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise click.BadParameter(f"invalid regex: {e}")
+    return value
+
+
+def _millis(ctx, param, value) -> Optional[int]:
+    return None if value is None else int(value.timestamp() * 1000)
+
+
 @click.command()
 @click.option(
     "--active/--inactive", default=True, help="Filter Active / Inactive emails"
 )
-@click.option("--search", default=None, help="Search emails by label")
-def listcommand(active, search):
+@click.option(
+    "--search", default=None, callback=_regex, help="Search emails by label regex"
+)
+@click.option("--note", default=None, callback=_regex, help="Search by note regex")
+@click.option("--hme", default=None, callback=_regex, help="Search by address regex")
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    callback=_millis,
+    help="Only emails created at or after this date",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    callback=_millis,
+    help="Only emails created before this date",
+)
+@click.option("--limit", type=click.IntRange(min=0), help="Show at most this many")
+@click.option(
+    "--offset",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Skip this many matching emails first",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["table", "jsonl", "csv"]),
+    help="Output format, a table on a terminal and jsonl otherwise",
+)
+@click.option(
+    "--refresh", is_flag=True, help="Download the list instead of using the inventory"
+)
+@click.pass_context
+def listcommand(
+    ctx, active, search, note, hme, since, until, limit, offset, fmt, refresh
+):
     "List emails"
+    import sys
+
+    if fmt is None:
+        # the table is for people, pipes get one JSON object per line
+        fmt = "table" if sys.stdout.isatty() else "jsonl"
+    filters = dict(
+        note=note, hme=hme, since=since, until=until, limit=limit, offset=offset
+    )
+    if ctx.obj["daemon"]:
+        from remote import remote_list
+
+        remote_list(ctx.obj["daemon"], active, search, refresh, fmt, **filters)
+        return
+    import asyncio
+    import main
+
+    main.select_loop()
     loop = asyncio.new_event_loop()
     try:
-        loop.run_until_complete(list(active, search, label="", notes=""))
+        loop.run_until_complete(
+            main.list(
+                active, search, label="", notes="", refresh=refresh, fmt=fmt, **filters
+            )
+        )
     except KeyboardInterrupt:
         pass
 
@@ -40,16 +254,28 @@ def listcommand(active, search):
 @click.command()
 @click.argument("emails", nargs=-1)
 @click.option("--file", type=click.File("r"), help="to delete emails from file")
-def deletecommand(emails, file):
+@click.option(
+    "--concurrency",
+    default=MAX_BULK_TASKS,
+    show_default=True,
+    help="How many emails to process at once",
+    type=click.IntRange(min=1),
+)
+@click.pass_context
+def deletecommand(ctx, emails, file, concurrency):
     "Remove emails"
-    if emails:
-        try:
-            asyncio.run(delete(emails))
-        except KeyboardInterrupt:
-            pass
-    elif file:
+    if emails or file:
+        if ctx.obj["daemon"]:
+            from remote import remote_action
+
+            remote_action(ctx.obj["daemon"], "delete", emails or file, concurrency)
+            return
+        import asyncio
+        import main
+
+        main.select_loop()
         try:
-            asyncio.run(delete(file))
+            asyncio.run(main.delete(emails or file, concurrency))
         except KeyboardInterrupt:
             pass
     else:
@@ -59,16 +285,28 @@ def deletecommand(emails, file):
 @click.command()
 @click.argument("emails", nargs=-1)
 @click.option("--file", type=click.File("r"), help="to deactivate emails from file")
-def deactivatecommand(emails, file):
+@click.option(
+    "--concurrency",
+    default=MAX_BULK_TASKS,
+    show_default=True,
+    help="How many emails to process at once",
+    type=click.IntRange(min=1),
+)
+@click.pass_context
+def deactivatecommand(ctx, emails, file, concurrency):
     "Deactivate emails"
-    if emails:
-        try:
-            asyncio.run(deactivate(emails))
-        except KeyboardInterrupt:
-            pass
-    elif file:
+    if emails or file:
+        if ctx.obj["daemon"]:
+            from remote import remote_action
+
+            remote_action(ctx.obj["daemon"], "deactivate", emails or file, concurrency)
+            return
+        import asyncio
+        import main
+
+        main.select_loop()
         try:
-            asyncio.run(deactivate(file))
+            asyncio.run(main.deactivate(emails or file, concurrency))
         except KeyboardInterrupt:
             pass
     else:
@@ -78,16 +316,28 @@ def deactivatecommand(emails, file):
 @click.command()
 @click.argument("emails", nargs=-1)
 @click.option("--file", type=click.File("r"), help="to reactivate emails from file")
-def reactivatecommand(emails, file):
+@click.option(
+    "--concurrency",
+    default=MAX_BULK_TASKS,
+    show_default=True,
+    help="How many emails to process at once",
+    type=click.IntRange(min=1),
+)
+@click.pass_context
+def reactivatecommand(ctx, emails, file, concurrency):
     "Reactivate emails"
-    if emails:
-        try:
-            asyncio.run(reactivate(emails))
-        except KeyboardInterrupt:
-            pass
-    elif file:
+    if emails or file:
+        if ctx.obj["daemon"]:
+            from remote import remote_action
+
+            remote_action(ctx.obj["daemon"], "reactivate", emails or file, concurrency)
+            return
+        import asyncio
+        import main
+
+        main.select_loop()
         try:
-            asyncio.run(reactivate(file))
+            asyncio.run(main.reactivate(emails or file, concurrency))
         except KeyboardInterrupt:
             pass
     else:
@@ -103,10 +353,238 @@ def reactivatecommand(emails, file):
         ["chrome", "safari", "firefox", "internet_explorer"], case_sensitive=False
     ),
 )
-def extract_cookies(browser: str):
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Extract again even if cookie.txt has not expired yet",
+)
+def extract_cookies(browser: str, force: bool):
     "To extract cookies from browser(Chrome, Safari, Firefox and IE)"
+    from cookies import CookiesManager
+
     cookies = CookiesManager()
-    cookies.cookie_writer(browser)
+    cookies.cookie_writer(browser, force)
+
+
+@click.command()
+@click.option(
+    "--host", default="127.0.0.1", show_default=True, help="Address to listen on"
+)
+@click.option(
+    "--port",
+    default=DEFAULT_PORT,
+    show_default=True,
+    help="Port to listen on",
+    type=int,
+)
+@click.option(
+    "--socket",
+    "path",
+    type=click.Path(dir_okay=False),
+    help="Listen on this Unix socket instead of TCP",
+)
+@click.option(
+    "--pool-low",
+    default=POOL_LOW,
+    show_default=True,
+    help="Refill the reservoir once it is down to this many emails",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--pool-high",
+    default=0,
+    help="Keep up to this many reserved emails ready for checkout, 0 disables refilling",
+    type=click.IntRange(min=0),
+)
+def servecommand(
+    host: str, port: int, path: Optional[str], pool_low: int, pool_high: int
+):
+    "Keep a warm session and inventory, serving a local API"
+    import asyncio
+    import daemon
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(daemon.serve(host, port, path, pool_low, pool_high))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option("--label", required=True, help="Label to stamp on the email")
+@click.option("--notes", required=False, help="Notes to stamp on the email")
+@click.option("--count", default=1, help="How many emails to check out", type=int)
+@click.pass_context
+def checkoutcommand(ctx, label: str, notes: Optional[str], count: int):
+    "Hand out reserved emails from the reservoir"
+    if ctx.obj["daemon"]:
+        from remote import remote_checkout
+
+        remote_checkout(ctx.obj["daemon"], label, notes, count)
+        return
+    import asyncio
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(main.checkout(label, notes, count))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option(
+    "--high",
+    default=POOL_HIGH,
+    show_default=True,
+    help="Reserve emails until the reservoir holds this many",
+    type=click.IntRange(min=1),
+)
+def fillcommand(high: int):
+    "Top up the reservoir of reserved emails"
+    import asyncio
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(main.fill(high))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+def plancommand(file: str):
+    "Show what apply would change to match a desired-state file"
+    import asyncio
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(main.plan(file))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--concurrency",
+    default=MAX_BULK_TASKS,
+    show_default=True,
+    help="How many emails to change at once",
+    type=click.IntRange(min=1),
+)
+def applycommand(file: str, concurrency: int):
+    "Change emails to match a desired-state file"
+    import asyncio
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(main.apply(file, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option("--label", help="New label, the current one is kept if omitted")
+@click.option("--note", help="New note, the current one is kept if omitted")
+@click.option(
+    "--match-label",
+    default=None,
+    callback=_regex,
+    help="Only emails whose label matches this regex",
+)
+@click.option(
+    "--match-note",
+    default=None,
+    callback=_regex,
+    help="Only emails whose note matches this regex",
+)
+@click.option(
+    "--match-hme",
+    default=None,
+    callback=_regex,
+    help="Only emails whose address matches this regex",
+)
+@click.option("--active/--inactive", default=None, help="Only active / inactive emails")
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    callback=_millis,
+    help="Only emails created at or after this date",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    callback=_millis,
+    help="Only emails created before this date",
+)
+@click.option(
+    "--file",
+    type=click.File("r"),
+    help="Only the emails listed in this file, e.g. the failures of an earlier run",
+)
+@click.option("--all", "everything", is_flag=True, help="Select every email")
+@click.option(
+    "--concurrency",
+    default=MAX_BULK_TASKS,
+    show_default=True,
+    help="How many emails to update at once",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Most requests per second",
+)
+@click.option(
+    "--failed",
+    default="relabel_failed.txt",
+    show_default=True,
+    help="File failed emails are written to, pass it back with --file to retry",
+)
+def relabelcommand(
+    label: Optional[str],
+    note: Optional[str],
+    match_label: Optional[str],
+    match_note: Optional[str],
+    match_hme: Optional[str],
+    active: Optional[bool],
+    since: Optional[int],
+    until: Optional[int],
+    file,
+    everything: bool,
+    concurrency: int,
+    rate: Optional[float],
+    failed: str,
+):
+    "Set a new label and/or note on existing emails"
+    if label is None and note is None:
+        raise click.UsageError("Pass --label, --note or both.")
+    filters = dict(
+        active=active,
+        label=match_label,
+        note=match_note,
+        hme=match_hme,
+        since=since,
+        until=until,
+    )
+    if not everything and file is None and all(v is None for v in filters.values()):
+        raise click.UsageError(
+            "Select emails with --match-*, --active/--inactive, --since/--until "
+            "or --file, or pass --all."
+        )
+    import asyncio
+    import main
+
+    main.select_loop()
+    try:
+        asyncio.run(main.relabel(label, note, filters, file, concurrency, rate, failed))
+    except KeyboardInterrupt:
+        pass
 
 
 cli.add_command(listcommand, name="list")
@@ -115,14 +593,24 @@ cli.add_command(deletecommand, name="delete")
 cli.add_command(deactivatecommand, name="deactivate")
 cli.add_command(reactivatecommand, name="reactivate")
 cli.add_command(extract_cookies, name="extract")
+cli.add_command(servecommand, name="serve")
+cli.add_command(checkoutcommand, name="checkout")
+cli.add_command(fillcommand, name="fill")
+cli.add_command(plancommand, name="plan")
+cli.add_command(applycommand, name="apply")
+cli.add_command(relabelcommand, name="relabel")
 
 if __name__ == "__main__":
     cli()
 
 if __name__ == "__main__":
+    import asyncio
+    import main
+
+    main.select_loop()
     loop = asyncio.new_event_loop()
     try:
-        loop.run_until_complete(generate(None, label="", notes=""))
+        loop.run_until_complete(main.generate(None, label="", notes=""))
     except KeyboardInterrupt:
         pass
     finally:
@@ -1,12 +1,21 @@
-import rookiepy
+import time
 from typing import List, Dict, Union
 from rich.console import Console
 from sys import platform
 
+from icloud.cookies import (
+    ICLOUD_DOMAIN,
+    BrowserCookies,
+    FileCookies,
+    format_cookies,
+    write_cookie_file,
+)
+
 
 class CookiesManager:
-    def __init__(self):
+    def __init__(self, path: str = "cookie.txt"):
         self.console = Console()
+        self.path = path
         self.browser_map = ["chrome", "firefox"]
         if platform == "darwin":
             self.browser_map.append("safari")
@@ -23,29 +32,39 @@ class CookiesManager:
                 f" on platform [italic][bold yellow]{platform}[/][/]"
             )
             return
-        browser_object = getattr(rookiepy, browser)
-        return browser_object([domain])
-
-    def _cookies_formatter(self, cookies: List[Dict[str, str]]) -> str:
-        return ";".join(
-            f"{cookie['name']}={cookie['value']}"
-            for cookie in cookies
-            if cookie.get("name", "").startswith(("X-APPLE", "X_APPLE"))
-        )
+        return BrowserCookies(browser, domain).extract()
 
-    def cookie_writer(self, browser: str) -> None:
+    def cookie_writer(self, browser: str, force: bool = False) -> None:
+        # decrypting the browser store is slow, skip it while the file is valid
+        cached = FileCookies(self.path)
+        if (
+            not force
+            and cached.get()
+            and cached.expires is not None
+            and not cached.expired
+        ):
+            self.console.log(
+                f":white_check_mark: Cookies in [italic]{self.path}[/] are valid until "
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(cached.expires))}, "
+                f"use --force to extract again."
+            )
+            return
         try:
-            cookies = self._get_cookies_from_browser(browser, ".icloud.com")
+            cookies = self._get_cookies_from_browser(browser, ICLOUD_DOMAIN)
             if not cookies:
                 self.console.log(
                     f":x: No valid cookies found for {browser}. Skipping file write."
                 )
                 return
-            formatted_cookies = self._cookies_formatter(cookies)
-            with open("cookie.txt", "w", encoding="utf-8") as fo:
-                fo.write(formatted_cookies)
+            formatted_cookies, expires = format_cookies(cookies)
+            if not formatted_cookies:
+                self.console.log(
+                    f":x: No iCloud cookies found for {browser}. Skipping file write."
+                )
+                return
+            write_cookie_file(self.path, formatted_cookies, expires)
             self.console.log(
-                f":white_check_mark: Cookies successfully written to [italic]cookie.txt[/] from [italic]{browser}[/]."
+                f":white_check_mark: Cookies successfully written to [italic]{self.path}[/] from [italic]{browser}[/]."
             )
         except Exception as e:
             self.console.log(
@@ -0,0 +1,269 @@
+import asyncio
+import hmac
+import json
+import os
+import re
+import secrets
+from collections import Counter
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from aiohttp import web
+
+from icloud.records import Alias
+from main import RichHideMyEmail
+from settings import (
+    DAEMON_TOKEN_ENVVAR,
+    DEFAULT_PORT,
+    MAX_BULK_TASKS,
+    MAX_CONCURRENT_TASKS,
+)
+
+# Host headers a local TCP daemon answers to, anything else is DNS rebinding
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+
+
+def _error(reason: str, status: int = 400) -> web.Response:
+    return web.json_response(
+        {"success": False, "error": 1, "reason": reason}, status=status
+    )
+
+
+def _ok(result: dict) -> web.Response:
+    return web.json_response({"success": True, "result": result})
+
+
+async def _body(request: web.Request) -> Optional[dict]:
+    """The request's JSON object, None when the body is not one"""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _positive_int(body: dict, key: str, default: int) -> Optional[int]:
+    value = body.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        return None
+    return value
+
+
+class _Collected:
+    """Stands in for a sink, keeps the aliases reserved by one request"""
+
+    def __init__(self):
+        self.aliases: List[Alias] = []
+
+    def write(self, alias: Alias, account: str = "") -> None:
+        self.aliases.append(alias)
+
+
+class HideMyEmailDaemon:
+    def __init__(
+        self,
+        hme: RichHideMyEmail,
+        token: Optional[str] = None,
+        local_hosts: Iterable[str] = (),
+    ):
+        """Local JSON API over one entered client.
+
+        The client's session, inventory and anonymousId index stay warm between
+        requests. Generation is serialized since label and notes belong to the
+        client; list and bulk actions run concurrently.
+
+        A web page can reach a port on localhost, so requests from a browser
+        are refused: POST bodies must be application/json, any Origin header
+        is rejected and, with `local_hosts`, so is any other Host header.
+
+        Args:
+            hme (RichHideMyEmail)   Entered client requests are served with
+            token (str)             Expected as "Authorization: Bearer <token>", None disables the check
+            local_hosts (iterable)  Host names the daemon answers to, empty accepts any
+        """
+        self.hme = hme
+        self.token = token
+        self.local_hosts = {host.lower() for host in local_hosts}
+        self._generating = asyncio.Lock()
+
+    @web.middleware
+    async def _guard(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        if "Origin" in request.headers:
+            return _error("Cross-origin requests are not allowed", status=403)
+        host = re.sub(r":\d+$", "", request.host or "").lower()
+        if self.local_hosts and host not in self.local_hosts:
+            return _error("Unknown Host header", status=403)
+        if self.token is not None and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {self.token}"
+        ):
+            return _error("Missing or wrong token", status=401)
+        if request.method == "POST" and request.content_type != "application/json":
+            return _error("Content-Type must be application/json", status=415)
+        return await handler(request)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._guard])
+        app.add_routes(
+            [
+                web.get("/health", self.health),
+                web.post("/generate", self.generate),
+                web.get("/list", self.list),
+                web.post("/delete", self.action),
+                web.post("/deactivate", self.action),
+                web.post("/reactivate", self.action),
+                web.post("/checkout", self.checkout),
+            ]
+        )
+        return app
+
+    async def health(self, request: web.Request) -> web.Response:
+        return _ok(
+            {
+                "account": self.hme.account,
+                "synced_at": self.hme.inventory.synced_at,
+                "reservoir": self.hme.reservoir.size,
+            }
+        )
+
+    async def checkout(self, request: web.Request) -> web.Response:
+        body = await _body(request)
+        if body is None:
+            return _error("Body must be a JSON object")
+        if not body.get("label"):
+            return _error("label is required")
+        alias = await self.hme.checkout(body["label"], body.get("notes"))
+        if alias is None:
+            return _error("No email could be checked out", status=503)
+        return _ok({"aliases": [alias.as_json()]})
+
+    async def generate(self, request: web.Request) -> web.Response:
+        body = await _body(request)
+        if body is None:
+            return _error("Body must be a JSON object")
+        count = _positive_int(body, "count", 0)
+        concurrency = _positive_int(body, "concurrency", MAX_CONCURRENT_TASKS)
+        reserve_concurrency = _positive_int(
+            body, "reserve_concurrency", MAX_CONCURRENT_TASKS
+        )
+        if count is None:
+            return _error("count must be a positive integer")
+        if concurrency is None or reserve_concurrency is None:
+            return _error("concurrency must be a positive integer")
+        async with self._generating:
+            self.hme.label, self.hme.notes = body.get("label"), body.get("notes")
+            self.hme.sink = reserved = _Collected()
+            try:
+                await self.hme._generate(count, concurrency, reserve_concurrency)
+            finally:
+                self.hme.sink = None
+        return _ok({"aliases": [alias.as_json() for alias in reserved.aliases]})
+
+    async def list(self, request: web.Request) -> web.Response:
+        query = request.query
+        if query.get("refresh") == "1" or self.hme._inventory_stale:
+            aliases, res = await self.hme._sync_inventory()
+            if aliases is None:
+                return _error(str((res or {}).get("reason", "Unknown")), status=502)
+        active = query.get("active")
+        try:
+            filters = {
+                key: int(query[key])
+                for key in ("since", "until", "limit", "offset")
+                if query.get(key)
+            }
+            aliases = self.hme.inventory.iter_search(
+                active=None if active is None else active == "1",
+                label=query.get("search"),
+                note=query.get("note"),
+                hme=query.get("hme"),
+                **filters,
+            )
+            return _ok({"aliases": [alias.as_json() for alias in aliases]})
+        except (ValueError, re.error) as e:
+            return _error(f"Invalid filter: {e}")
+
+    async def action(self, request: web.Request) -> web.Response:
+        name = request.path.strip("/")
+        action_one = getattr(self.hme, f"_{name}_one")
+        body = await _body(request)
+        if body is None:
+            return _error("Body must be a JSON object")
+        concurrency = _positive_int(body, "concurrency", MAX_BULK_TASKS)
+        if concurrency is None:
+            return _error("concurrency must be a positive integer")
+        emails = body.get("emails") or []
+        if not isinstance(emails, list) or not all(
+            isinstance(email, str) for email in emails
+        ):
+            return _error("emails must be a list of strings")
+        skipped: Counter = Counter()
+        emails = self.hme._unique(emails, skipped)
+        succeeded: List[str] = []
+        failed: List[str] = []
+
+        async def worker() -> None:
+            for hme in emails:
+                (succeeded if await action_one(hme) else failed).append(hme)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return _ok({"succeeded": succeeded, "failed": failed, "skipped": skipped})
+
+
+async def serve(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    path: Optional[str] = None,
+    pool_low: int = 0,
+    pool_high: int = 0,
+) -> None:
+    """Serves the local API until cancelled, on a Unix socket when `path` is given.
+
+    Over TCP every request must carry the token from HME_DAEMON_TOKEN, a random
+    one is generated and logged when it is unset. A Unix socket is guarded by
+    its file permissions and only checks the token when one is set.
+
+    With `pool_high` set, the reservoir is kept between `pool_low` and `pool_high`
+    in the background.
+    """
+    token = os.getenv(DAEMON_TOKEN_ENVVAR) or None
+    generated = token is None and not path
+    if generated:
+        token = secrets.token_urlsafe(32)
+    async with RichHideMyEmail("", "", concurrency=MAX_BULK_TASKS) as hme:
+        # one download warms both the anonymousId index and the inventory
+        await hme._anonymous_ids.refresh()
+        if hme._anonymous_ids.error:
+            await hme._log_email_error(
+                hme._anonymous_ids.error, hme.account, action_name="get", target="list"
+            )
+        daemon = HideMyEmailDaemon(
+            hme, token, local_hosts=() if path else {*LOCAL_HOSTS, host}
+        )
+        runner = web.AppRunner(daemon.app(), access_log=None)
+        await runner.setup()
+        if path:
+            site: web.BaseSite = web.UnixSite(runner, path)
+        else:
+            site = web.TCPSite(runner, host, port)
+        await site.start()
+        hme.console.log(
+            f"[bold green]Serving[/] [italic]{hme.account}[/] on "
+            f"{f'unix:{path}' if path else f'http://{host}:{port}'}"
+        )
+        if generated:
+            hme.console.log("Clients need this token in their environment:")
+            # unwrapped so it can be copied
+            hme.console.print(
+                f"{DAEMON_TOKEN_ENVVAR}={token}", soft_wrap=True, highlight=False
+            )
+        if pool_high:
+            hme.reservoir.low, hme.reservoir.high = pool_low, pool_high
+            hme.reservoir.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await hme.reservoir.stop()
+            await runner.cleanup()
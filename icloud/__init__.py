@@ -1 +1,41 @@
-from .hidemyemail import HideMyEmail
+import importlib
+from typing import TYPE_CHECKING
+
+# name -> submodule, imported on first access so that e.g. `icloud.sinks`
+# alone does not pull in aiohttp
+_EXPORTS = {
+    "HideMyEmail": ".hidemyemail",
+    "AnonymousIdIndex": ".index",
+    "GenerationPipeline": ".pipeline",
+    "AdaptiveRateLimiter": ".ratelimit",
+    "Alias": ".records",
+    "GenerationJournal": ".journal",
+    "Metrics": ".metrics",
+    "RetryPolicy": ".retry",
+    "ConnectionSettings": ".connection",
+    "HideMyEmailAPI": ".api",
+    "HideMyEmailError": ".api",
+    "ActionResult": ".api",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module, __name__), name)
+
+
+if TYPE_CHECKING:
+    from .hidemyemail import HideMyEmail
+    from .index import AnonymousIdIndex
+    from .pipeline import GenerationPipeline
+    from .ratelimit import AdaptiveRateLimiter
+    from .records import Alias
+    from .journal import GenerationJournal
+    from .metrics import Metrics
+    from .retry import RetryPolicy
+    from .connection import ConnectionSettings
+    from .api import HideMyEmailAPI, HideMyEmailError, ActionResult
@@ -0,0 +1,238 @@
+import asyncio
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from .hidemyemail import HideMyEmail
+from .index import AnonymousIdIndex
+from .pipeline import GenerationPipeline
+from .records import Alias, parse_aliases, reserved_alias
+
+
+class HideMyEmailError(Exception):
+    """iCloud answered a request with an error"""
+
+    def __init__(self, reason: str, response: Optional[dict] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.response = response
+
+
+class ActionResult(NamedTuple):
+    """Outcome of a bulk action for one email"""
+
+    hme: str
+    success: bool
+    # iCloud's error message, empty on success
+    reason: str = ""
+    response: Optional[dict] = None
+
+
+def error_reason(res: Optional[dict]) -> str:
+    """The error message of a failed response"""
+    if not res:
+        return "No response"
+    error = res.get("error", {})
+    if isinstance(error, dict):
+        return error.get("errorMessage", "Unknown")
+    return res.get("reason", "Unknown")
+
+
+class HideMyEmailAPI(HideMyEmail):
+    """Headless client for embedding in asyncio code.
+
+    Nothing is printed: aliases are yielded as they are reserved, failures are
+    raised as `HideMyEmailError` or returned as `ActionResult`s.
+
+        async with HideMyEmailAPI("shop", "", cookies=cookies) as hme:
+            async for alias in hme.iter_generate(10):
+                ...
+            results = await hme.delete(["a@icloud.com", "b@icloud.com"])
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # hme -> anonymousId for bulk actions, fetched once on first use
+        self.index = AnonymousIdIndex(self.list_email)
+
+    async def iter_generate(
+        self,
+        count: int,
+        concurrency: int = 5,
+        reserve_concurrency: int = 5,
+        max_failed_attempts: int = 10,
+    ) -> AsyncIterator[Alias]:
+        """Yields each alias the moment it is reserved, with the client's label and notes.
+
+        Stops after `count` aliases, or early once generation keeps failing (see
+        GenerationPipeline). Leaving the loop early cancels the requests in flight.
+        """
+        reserved: asyncio.Queue = asyncio.Queue()
+
+        def on_reserved(email: str, res: dict) -> None:
+            alias = reserved_alias(email, res, self.label or "", self.notes or "")
+            if alias.anonymous_id:
+                self.index.add(alias.hme, alias.anonymous_id)
+            reserved.put_nowait(alias)
+
+        pipeline = GenerationPipeline(
+            self,
+            count,
+            generate_concurrency=concurrency,
+            reserve_concurrency=reserve_concurrency,
+            max_failed_attempts=max_failed_attempts,
+            on_reserved=on_reserved,
+        )
+        run = asyncio.ensure_future(pipeline.run())
+        # the pipeline finishing is the end-of-stream marker
+        run.add_done_callback(lambda _: reserved.put_nowait(None))
+        try:
+            while True:
+                alias = await reserved.get()
+                if alias is None:
+                    break
+                yield alias
+            # surfaces an exception raised inside the pipeline
+            await run
+        finally:
+            if not run.done():
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+
+    async def aliases(self) -> List[Alias]:
+        """Every alias of the account, from one list call"""
+        res = await self.list_email()
+        aliases = parse_aliases(res)
+        if aliases is None:
+            raise HideMyEmailError(error_reason(res), res)
+        return aliases
+
+    async def iter_list(
+        self, page_size: int = 100, active: Optional[bool] = None
+    ) -> AsyncIterator[List[Alias]]:
+        """Yields the account's aliases in pages of `page_size`, newest first.
+
+        iCloud returns the whole list in one response. Rows are only turned
+        into aliases page by page, as the caller asks for them.
+        """
+        res = await self.list_email()
+        try:
+            rows = res["result"]["hmeEmails"]
+        except (KeyError, TypeError):
+            raise HideMyEmailError(error_reason(res), res)
+        if active is not None:
+            rows = [row for row in rows if bool(row.get("isActive", True)) == active]
+        rows = sorted(
+            rows, key=lambda row: row.get("createTimestamp") or 0, reverse=True
+        )
+        page_size = max(1, page_size)
+        for start in range(0, len(rows), page_size):
+            yield [Alias.from_json(row) for row in rows[start : start + page_size]]
+
+    async def _bulk(
+        self,
+        emails: Iterable[Union[str, Alias]],
+        action: Callable[[str, Union[str, Alias]], Awaitable[dict]],
+        concurrency: int,
+    ) -> List[ActionResult]:
+        # input order is kept, blank and duplicate emails are left out
+        items = {}
+        for email in emails:
+            hme = (email.hme if isinstance(email, Alias) else email).strip()
+            if hme and hme not in items:
+                items[hme] = email
+        results = {}
+        pending = iter(items.items())
+
+        async def worker() -> None:
+            # shared iterator: every email is picked up by exactly one worker
+            for hme, email in pending:
+                anonymous_id = isinstance(email, Alias) and email.anonymous_id
+                anonymous_id = anonymous_id or await self.index.get(hme)
+                if anonymous_id is None:
+                    reason = (
+                        error_reason(self.index.error)
+                        if self.index.error
+                        else "No anonymousId found"
+                    )
+                    results[hme] = ActionResult(hme, False, reason, self.index.error)
+                    continue
+                res = await action(anonymous_id, email)
+                if res and res.get("success"):
+                    results[hme] = ActionResult(hme, True, response=res)
+                else:
+                    results[hme] = ActionResult(hme, False, error_reason(res), res)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        return [results[hme] for hme in items]
+
+    async def delete(
+        self, emails: Iterable[Union[str, Alias]], concurrency: int = 10
+    ) -> List[ActionResult]:
+        """Deletes emails, given as addresses or aliases, one result each"""
+        results = await self._bulk(
+            emails, lambda anonymous_id, _: self.delete_email(anonymous_id), concurrency
+        )
+        for result in results:
+            if result.success:
+                self.index.discard(result.hme)
+        return results
+
+    async def deactivate(
+        self, emails: Iterable[Union[str, Alias]], concurrency: int = 10
+    ) -> List[ActionResult]:
+        """Stops forwarding for emails, one result each"""
+        return await self._bulk(
+            emails,
+            lambda anonymous_id, _: self.deactivate_email(anonymous_id),
+            concurrency,
+        )
+
+    async def reactivate(
+        self, emails: Iterable[Union[str, Alias]], concurrency: int = 10
+    ) -> List[ActionResult]:
+        """Resumes forwarding for emails, one result each"""
+        return await self._bulk(
+            emails,
+            lambda anonymous_id, _: self.reactivate_email(anonymous_id),
+            concurrency,
+        )
+
+    async def relabel(
+        self,
+        aliases: Iterable[Alias],
+        label: Optional[str] = None,
+        note: Optional[str] = None,
+        concurrency: int = 10,
+    ) -> List[ActionResult]:
+        """Sets a new label and/or note on aliases, e.g. a page of `iter_list`.
+
+        A value left as None keeps each alias's current one, aliases that already
+        match are skipped without a request.
+        """
+        changes = [
+            alias
+            for alias in aliases
+            if (label is not None and alias.label != label)
+            or (note is not None and alias.note != note)
+        ]
+
+        async def update(anonymous_id: str, alias: Alias) -> dict:
+            res = await self.update_metadata(
+                anonymous_id,
+                alias.label if label is None else label,
+                alias.note if note is None else note,
+            )
+            if res and res.get("success"):
+                alias.label = alias.label if label is None else label
+                alias.note = alias.note if note is None else note
+            return res
+
+        return await self._bulk(changes, update, concurrency)
@@ -0,0 +1,56 @@
+import asyncio
+import json
+from typing import Any, Callable, Union
+
+# "auto" picks the fast implementation when it is installed
+JSON_BACKENDS = ("auto", "orjson", "json")
+LOOP_BACKENDS = ("auto", "uvloop", "asyncio")
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# swapped by `use_json`, callers go through the module attributes
+loads: Callable[[Union[bytes, str]], Any] = json.loads
+dumps: Callable[[Any], bytes] = _json_dumps
+json_backend = "json"
+
+
+def use_json(name: str = "auto") -> str:
+    """Selects the JSON codec of the client hot path, returns the one in use.
+
+    Raises ImportError when `name` is "orjson" and it is not installed,
+    "auto" falls back to the stdlib.
+    """
+    global loads, dumps, json_backend
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name == "orjson":
+                raise
+        else:
+            loads, dumps, json_backend = orjson.loads, orjson.dumps, "orjson"
+            return json_backend
+    loads, dumps, json_backend = json.loads, _json_dumps, "json"
+    return json_backend
+
+
+def use_loop(name: str = "auto") -> str:
+    """Installs the event loop policy new loops are built with, returns the one in use.
+
+    Raises ImportError when `name` is "uvloop" and it is not installed,
+    "auto" falls back to the stdlib loop. "asyncio" and that fallback leave
+    the current policy in place.
+    """
+    if name in ("auto", "uvloop"):
+        try:
+            import uvloop
+        except ImportError:
+            if name == "uvloop":
+                raise
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return "uvloop"
+    return "asyncio"
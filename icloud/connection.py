@@ -0,0 +1,55 @@
+import ssl
+from functools import lru_cache
+from typing import Optional
+
+import aiohttp
+import certifi
+
+
+@lru_cache(maxsize=None)
+def ssl_context() -> ssl.SSLContext:
+    """Process-wide SSL context, so the CA bundle is loaded once per process"""
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+class ConnectionSettings:
+    def __init__(
+        self,
+        limit: int = 20,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: Optional[int] = 300,
+        timeout: float = 10.0,
+    ):
+        """Connection pool tuning for the HideMyEmail client.
+
+        Every endpoint lives on a single host, so `limit` is effectively the
+        number of open connections; size it to the number of concurrent requests.
+
+        Args:
+            limit (int)                 Connections kept in the pool in total
+            limit_per_host (int)        Connections per host, 0 for no extra limit
+            keepalive_timeout (float)   Seconds an idle connection is kept open
+            dns_cache_ttl (int)         Seconds a resolved address is reused, None caches forever
+            timeout (float)             Default total timeout of a request
+        """
+        self.limit = max(1, limit)
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+
+    @classmethod
+    def for_concurrency(cls, concurrency: int, **kwargs) -> "ConnectionSettings":
+        """Settings with one pooled connection per concurrent request"""
+        return cls(limit=concurrency, **kwargs)
+
+    def connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            ssl=ssl_context(),
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
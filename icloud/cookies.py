@@ -0,0 +1,172 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# a cookie file line like `// expires 1767225600` records when the cookies run out
+EXPIRES_PREFIX = "// expires "
+ICLOUD_DOMAIN = ".icloud.com"
+# responses iCloud sends once the session cookies are no longer accepted
+AUTH_STATUSES = (401, 403, 421)
+# holds the Apple ID's DSID, e.g. X-APPLE-WEBAUTH-USER="v=1:s=0:d=12345678"
+WEBAUTH_USER_COOKIE = "X-APPLE-WEBAUTH-USER"
+
+
+class CookieError(Exception):
+    """No usable cookie string could be found"""
+
+
+class CookieProvider:
+    def __init__(self, ttl: Optional[float] = None):
+        """Source of the iCloud cookie string, cached until it expires.
+
+        Args:
+            ttl (float) Seconds a loaded cookie string is reused when its expiry is unknown, None for no limit
+        """
+        self.ttl = ttl
+        self._cookies: Optional[str] = None
+        self._expires: Optional[float] = None
+
+    def load(self) -> Tuple[Optional[str], Optional[float]]:
+        """Reads the cookie string and, if known, when it expires"""
+        raise NotImplementedError
+
+    @property
+    def expires(self) -> Optional[float]:
+        return self._expires
+
+    @property
+    def expired(self) -> bool:
+        return self._expires is not None and time.time() >= self._expires
+
+    def get(self, refresh: bool = False) -> Optional[str]:
+        """Cached cookie string, reloaded once expired or when `refresh` is set"""
+        if refresh or self._cookies is None or self.expired:
+            cookies, expires = self.load()
+            if expires is None and self.ttl is not None:
+                expires = time.time() + self.ttl
+            self._cookies, self._expires = cookies, expires
+        return self._cookies
+
+
+class StaticCookies(CookieProvider):
+    def __init__(self, cookies: str):
+        super().__init__()
+        self.cookies = cookies
+
+    def load(self) -> Tuple[Optional[str], Optional[float]]:
+        return self.cookies.strip() or None, None
+
+
+class FileCookies(CookieProvider):
+    def __init__(
+        self,
+        path: str,
+        fallback: Optional[CookieProvider] = None,
+        ttl: Optional[float] = None,
+    ):
+        """Cookie file as written by `extract` or by hand, `//` lines are comments.
+
+        A refresh re-reads the file if it changed on disk. Otherwise the
+        `fallback` (e.g. a browser) is asked and its cookies are written back to
+        the file.
+
+        Args:
+            path (str)                  Cookie file
+            fallback (CookieProvider)   Source to re-extract from when the file is stale
+            ttl (float)                 See CookieProvider
+        """
+        super().__init__(ttl)
+        self.path = path
+        self.fallback = fallback
+        self._mtime: Optional[float] = None
+
+    def _read(self) -> Tuple[Optional[str], Optional[float]]:
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= 1:
+            return None, None
+        self._mtime = os.path.getmtime(self.path)
+        cookies, expires = None, None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(EXPIRES_PREFIX):
+                    try:
+                        expires = float(line[len(EXPIRES_PREFIX) :])
+                    except ValueError:
+                        pass
+                elif not line.startswith("//") and line.strip() and cookies is None:
+                    cookies = line.strip()
+        return cookies, expires
+
+    def load(self) -> Tuple[Optional[str], Optional[float]]:
+        changed = (
+            self._mtime is None
+            or not os.path.exists(self.path)
+            or os.path.getmtime(self.path) != self._mtime
+        )
+        if changed or self.fallback is None:
+            cookies, expires = self._read()
+            if cookies is not None and cookies != self._cookies:
+                return cookies, expires
+            if self.fallback is None:
+                return cookies, expires
+        cookies = self.fallback.get(refresh=True)
+        if cookies is None:
+            return self._read()
+        write_cookie_file(self.path, cookies, self.fallback.expires)
+        self._mtime = os.path.getmtime(self.path)
+        return cookies, self.fallback.expires
+
+
+class BrowserCookies(CookieProvider):
+    def __init__(self, browser: str, domain: str = ICLOUD_DOMAIN):
+        """Decrypts the iCloud cookies out of a local browser profile with rookiepy.
+
+        Args:
+            browser (str)   rookiepy browser function, e.g. `chrome` or `firefox`
+            domain (str)    Cookie domain to extract
+        """
+        super().__init__()
+        self.browser = browser
+        self.domain = domain
+
+    def extract(self) -> List[Dict]:
+        # native extension, only loaded when a browser is actually read
+        import rookiepy
+
+        return getattr(rookiepy, self.browser)([self.domain]) or []
+
+    def load(self) -> Tuple[Optional[str], Optional[float]]:
+        return format_cookies(self.extract())
+
+
+def format_cookies(cookies: List[Dict]) -> Tuple[Optional[str], Optional[float]]:
+    """Joins the Apple auth cookies into a header value, with their earliest expiry"""
+    apple = [
+        cookie
+        for cookie in cookies
+        if (cookie.get("name") or "").startswith(("X-APPLE", "X_APPLE"))
+    ]
+    header = ";".join(f"{cookie['name']}={cookie['value']}" for cookie in apple)
+    expiries = [cookie["expires"] for cookie in apple if cookie.get("expires")]
+    return header or None, min(expiries) if expiries else None
+
+
+def cookie_dsid(cookies: Optional[str]) -> Optional[str]:
+    """The DSID of the Apple ID a cookie string signs in, None when it does not say"""
+    for cookie in (cookies or "").split(";"):
+        name, _, value = cookie.strip().partition("=")
+        if name != WEBAUTH_USER_COOKIE:
+            continue
+        for field in value.strip('"').split(":"):
+            key, _, dsid = field.partition("=")
+            if key == "d" and dsid:
+                return dsid
+    return None
+
+
+def write_cookie_file(path: str, cookies: str, expires: Optional[float]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if expires is not None:
+            f.write(f"{EXPIRES_PREFIX}{int(expires)}\n")
+        f.write(cookies)
+    os.replace(tmp, path)
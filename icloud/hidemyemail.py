@@ -1,13 +1,35 @@
 import asyncio
 import aiohttp
-import ssl
-import certifi
-from typing import Callable, Optional, Union
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from . import codec
+from .connection import ConnectionSettings
+from .cookies import AUTH_STATUSES, CookieProvider
+from .metrics import Metrics
+from .ratelimit import AdaptiveRateLimiter, is_quota_exhausted, is_throttled
+from .retry import DEFAULT_RETRY_POLICIES, RetryPolicy, is_ambiguous, is_retryable
+
+HEADERS = {
+    "Connection": "keep-alive",
+    "Pragma": "no-cache",
+    "Cache-Control": "no-cache",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+    "Content-Type": "text/plain",
+    "Accept": "*/*",
+    "Sec-GPC": "1",
+    "Origin": "https://www.icloud.com",
+    "Sec-Fetch-Site": "same-site",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Dest": "empty",
+    "Referer": "https://www.icloud.com/",
+    "Accept-Language": "en-US,en-GB;q=0.9,en;q=0.8,cs;q=0.7",
+}
 
 
 class HideMyEmail:
-    base_url_v1 = "https://p68-maildomainws.icloud.com/v1/hme"
-    base_url_v2 = "https://p68-maildomainws.icloud.com/v2/hme"
+    base_url = "https://p68-maildomainws.icloud.com"
+    base_url_v1 = f"{base_url}/v1/hme"
+    base_url_v2 = f"{base_url}/v2/hme"
     params = {
         "clientBuildNumber": "2413Project28",
         "clientMasteringNumber": "2413B20",
@@ -15,12 +37,33 @@ class HideMyEmail:
         "dsid": "",  # Directory Services Identifier (DSID) is a method of identifying AppleID accounts
     }
 
-    def __init__(self, label: Optional[str], notes: Optional[str], cookies: str = ""):
+    def __init__(
+        self,
+        label: Optional[str],
+        notes: Optional[str],
+        cookies: str = "",
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        base_url: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        retry_policies: Optional[Dict[str, RetryPolicy]] = None,
+        connection: Optional[ConnectionSettings] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+        cookie_provider: Optional[CookieProvider] = None,
+    ):
         """Initializes the HideMyEmail class.
 
         Args:
             label (str)     Label that will be set for all emails generated, defaults to `rtuna's gen`
             cookies (str)   Cookie string to be used with requests. Required for authorization.
+            limiter (AdaptiveRateLimiter)   Rate limiter shared by all endpoints, one is created if omitted
+            base_url (str)  Overrides the iCloud host, e.g. to point at a local mock server
+            metrics (Metrics)   Collects per-endpoint latency and outcomes, one is created if omitted
+            retry_policy (RetryPolicy)  Policy for endpoints without their own
+            retry_policies (dict)   Endpoint name (e.g. `reserve`) -> RetryPolicy, merged over the defaults
+            connection (ConnectionSettings) Pool size, keep-alive and DNS caching of the owned session
+            session (aiohttp.ClientSession) Externally owned session to send requests through, left open on exit
+            cookie_provider (CookieProvider)    Source of `cookies`, asked again when iCloud rejects them
         """
         # Label that will be set for all emails generated, defaults to `rtuna's gen`
         self.label = label
@@ -28,37 +71,46 @@ class HideMyEmail:
         self.notes = notes
 
         # Cookie string to be used with requests. Required for authorization.
+        self.cookie_provider = cookie_provider
+        if not cookies and cookie_provider is not None:
+            cookies = cookie_provider.get() or ""
         self.cookies = cookies
+        self._cookie_lock: Optional[asyncio.Lock] = None
+        self._rejected: Optional[str] = None
+
+        # Backs off when Apple throttles and probes back up on success
+        self.limiter = limiter or AdaptiveRateLimiter()
+
+        self.metrics = metrics or Metrics()
+
+        # Transient failures are retried with backoff, per endpoint
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_policies = {**DEFAULT_RETRY_POLICIES, **(retry_policies or {})}
+
+        self.connection = connection or ConnectionSettings()
+        self._session = session
+
+        if base_url:
+            self.base_url = base_url.rstrip("/")
+            self.base_url_v1 = f"{self.base_url}/v1/hme"
+            self.base_url_v2 = f"{self.base_url}/v2/hme"
 
     async def __aenter__(self):
-        connector = aiohttp.TCPConnector(
-            ssl_context=ssl.create_default_context(cafile=certifi.where())
-        )
+        if self._session is not None:
+            self.s = self._session
+            return self
         self.s = aiohttp.ClientSession(
-            headers={
-                "Connection": "keep-alive",
-                "Pragma": "no-cache",
-                "Cache-Control": "no-cache",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-                "Content-Type": "text/plain",
-                "Accept": "*/*",
-                "Sec-GPC": "1",
-                "Origin": "https://www.icloud.com",
-                "Sec-Fetch-Site": "same-site",
-                "Sec-Fetch-Mode": "cors",
-                "Sec-Fetch-Dest": "empty",
-                "Referer": "https://www.icloud.com/",
-                "Accept-Language": "en-US,en-GB;q=0.9,en;q=0.8,cs;q=0.7",
-                "Cookie": self.__cookies.strip(),
-            },
-            timeout=aiohttp.ClientTimeout(total=10),
-            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=self.connection.timeout),
+            connector=self.connection.connector(),
         )
 
         return self
 
     async def __aexit__(self, exc_t, exc_v, exc_tb):
-        await self.s.close()
+        # an external session belongs to whoever passed it in
+        if self._session is None:
+            await self.s.close()
 
     @property
     def cookies(self) -> str:
@@ -69,93 +121,210 @@ class HideMyEmail:
         # remove new lines/whitespace for security reasons
         self.__cookies = cookies.strip()
 
-    async def generate_email(self) -> dict:
-        """Generates an email"""
+    def _headers(self) -> Dict[str, str]:
+        # sent per request so a shared session can serve several accounts
+        if self._session is None:
+            return {"Cookie": self.cookies}
+        return {**HEADERS, "Cookie": self.cookies}
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        endpoint: str,
+        timeout: aiohttp.ClientTimeout,
+        **kwargs,
+    ) -> Tuple[dict, str, Optional[int]]:
+        """Sends one rate limited, instrumented request and feeds the outcome back to the limiter"""
+        await self.limiter.acquire()
+        started = self.metrics.start(endpoint)
+        # stays "cancelled" when the task is cancelled mid-request
+        status, nbytes, outcome = None, 0, "cancelled"
         try:
-            async with self.s.post(
-                f"{self.base_url_v1}/generate",
-                params=self.params,
-                json={"langCode": "en-us"},
-            ) as resp:
-                res = await resp.json()
-                return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
-
-    async def reserve_email(self, email: str) -> dict:
-        """Reserves an email and registers it for forwarding"""
+            try:
+                async with self.s.request(
+                    method,
+                    url,
+                    params=self.params,
+                    headers=self._headers(),
+                    timeout=timeout,
+                    **kwargs,
+                ) as resp:
+                    status = resp.status
+                    body = await resp.read()
+                    nbytes = len(body)
+                    # decoded with the configured codec, an empty body is None like `resp.json()`
+                    res = codec.loads(body) if body.strip() else None
+                    outcome = "ok"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                res = {"error": 1, "reason": "Request timed out"}
+            except Exception as e:
+                outcome = type(e).__name__
+                res = {"error": 1, "reason": str(e)}
+            if is_throttled(status, res):
+                outcome = "throttled"
+                self.limiter.on_throttle()
+            elif status is not None and status < 400:
+                self.limiter.on_success()
+            if outcome == "ok" and is_quota_exhausted(res):
+                outcome = "quota"
+            elif outcome == "ok" and not (res or {}).get("success"):
+                outcome = "api_error"
+            return res, outcome, status
+        finally:
+            self.metrics.finish(endpoint, started, outcome, status, nbytes)
+
+    async def _refresh_cookies(self, stale: str) -> bool:
+        """Swaps in fresh cookies after `stale` was rejected, True if there are new ones.
+
+        Requests failing together share one reload, the others just retry with
+        whatever it produced.
+        """
+        if self.cookie_provider is None:
+            return False
+        if self._cookie_lock is None:
+            self._cookie_lock = asyncio.Lock()
+        async with self._cookie_lock:
+            if self.cookies != stale:
+                return True
+            if stale == self._rejected:
+                # already reloaded for these cookies and nothing better came up
+                return False
+            # reading a browser profile blocks, keep the loop responsive
+            cookies = await asyncio.get_running_loop().run_in_executor(
+                None, self.cookie_provider.get, True
+            )
+            if not cookies or cookies.strip() == stale:
+                self._rejected = stale
+                return False
+            self.cookies = cookies
+            return True
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        confirm: Optional[Callable[[], Awaitable[Optional[dict]]]] = None,
+        **kwargs,
+    ) -> dict:
+        """Sends a request, retrying transient failures per the endpoint's RetryPolicy.
+
+        When the last attempt may have been applied without an answer coming
+        back, `confirm` is asked for the response instead, None keeps the failure.
+        """
+        endpoint = url.rsplit("/", 1)[-1]
+        policy = self.retry_policies.get(endpoint, self.retry_policy)
+        if "json" in kwargs:
+            # encoded once for all attempts, same text/plain body as aiohttp's `json=`
+            kwargs["data"] = codec.dumps(kwargs.pop("json"))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.budget
+        attempt = 0
+        while True:
+            timeout = aiohttp.ClientTimeout(
+                total=max(0.0, deadline - loop.time()),
+                sock_connect=policy.connect_timeout,
+                sock_read=policy.read_timeout,
+            )
+            sent_with = self.cookies
+            res, outcome, status = await self._send(
+                method, url, endpoint, timeout, **kwargs
+            )
+            if status in AUTH_STATUSES and await self._refresh_cookies(sent_with):
+                # retried with the new cookies, not counted as an attempt
+                continue
+            attempt += 1
+            if attempt >= policy.attempts or not is_retryable(
+                outcome, status, res, policy.idempotent
+            ):
+                break
+            delay = policy.delay(attempt - 1)
+            if loop.time() + delay >= deadline:
+                break
+            self.metrics.retry(endpoint)
+            await asyncio.sleep(delay)
+        if confirm is not None and is_ambiguous(outcome, status, res):
+            return await confirm() or res
+        return res
+
+    async def _listed(self, key: str, value: str) -> Tuple[bool, Optional[dict]]:
+        """Looks a reserved email up in a fresh list, by `hme` or `anonymousId`.
+
+        Returns whether the list could be read, and the matching row if any.
+        """
+        res = await self.list_email()
         try:
-            payload = {
-                "hme": email,
-                "label": self.label,
-                "note": self.notes,
-            }
-            async with self.s.post(
-                f"{self.base_url_v1}/reserve", params=self.params, json=payload
-            ) as resp:
-                res = await resp.json()
-            return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
+            rows = res["result"]["hmeEmails"]
+        except (KeyError, TypeError):
+            return False, None
+        return True, next((row for row in rows if row.get(key) == value), None)
+
+    async def _confirm_reserved(self, email: str) -> Optional[dict]:
+        _, row = await self._listed("hme", email)
+        if row is None:
+            return None
+        return {"success": True, "result": {"hme": row}}
+
+    async def _confirm_deleted(self, anonymousId: str) -> Optional[dict]:
+        listed, row = await self._listed("anonymousId", anonymousId)
+        if not listed or row is not None:
+            return None
+        return {"success": True, "result": {}}
+
+    async def generate_email(self) -> dict:
+        """Generates an email"""
+        return await self._request(
+            "POST", f"{self.base_url_v1}/generate", json={"langCode": "en-us"}
+        )
+
+    async def reserve_email(
+        self, email: str, label: Optional[str] = None, notes: Optional[str] = None
+    ) -> dict:
+        """Reserves an email and registers it for forwarding, with the client's label and notes unless given"""
+        payload = {
+            "hme": email,
+            "label": self.label if label is None else label,
+            "note": self.notes if notes is None else notes,
+        }
+        return await self._request(
+            "POST",
+            f"{self.base_url_v1}/reserve",
+            confirm=lambda: self._confirm_reserved(email),
+            json=payload,
+        )
 
     async def list_email(self) -> dict:
         """List all HME"""
-        try:
-            async with self.s.get(
-                f"{self.base_url_v2}/list", params=self.params
-            ) as resp:
-                res = await resp.json()
-                return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
+        return await self._request("GET", f"{self.base_url_v2}/list")
 
     async def delete_email(self, anonymousId: str) -> dict:
         """Delete email"""
-        try:
-            async with self.s.post(
-                f"{self.base_url_v1}/delete",
-                params=self.params,
-                json={"anonymousId": anonymousId},
-            ) as resp:
-                res = await resp.json()
-                return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
+        return await self._request(
+            "POST",
+            f"{self.base_url_v1}/delete",
+            confirm=lambda: self._confirm_deleted(anonymousId),
+            json={"anonymousId": anonymousId},
+        )
 
     async def deactivate_email(self, anonymousId: str) -> dict:
         """Deactivate emails for forwarding"""
-        try:
-            async with self.s.post(
-                f"{self.base_url_v1}/deactivate",
-                params=self.params,
-                json={"anonymousId": anonymousId},
-            ) as resp:
-                res = await resp.json()
-                return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
+        return await self._request(
+            "POST", f"{self.base_url_v1}/deactivate", json={"anonymousId": anonymousId}
+        )
 
     async def reactivate_email(self, anonymousId: str) -> dict:
         """Reactivate emails for forwarding"""
-        try:
-            async with self.s.post(
-                f"{self.base_url_v1}/reactivate",
-                params=self.params,
-                json={"anonymousId": anonymousId},
-            ) as resp:
-                res = await resp.json()
-                return res
-        except asyncio.TimeoutError:
-            return {"error": 1, "reason": "Request timed out"}
-        except Exception as e:
-            return {"error": 1, "reason": str(e)}
+        return await self._request(
+            "POST", f"{self.base_url_v1}/reactivate", json={"anonymousId": anonymousId}
+        )
+
+    async def update_metadata(
+        self, anonymousId: str, label: str, notes: Optional[str] = None
+    ) -> dict:
+        """Sets the label and notes of a reserved email"""
+        return await self._request(
+            "POST",
+            f"{self.base_url_v1}/updateMetaData",
+            json={"anonymousId": anonymousId, "label": label, "note": notes or ""},
+        )
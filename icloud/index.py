@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .records import Alias, parse_aliases
+
+
+class AnonymousIdIndex:
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[dict]],
+        cache_file: Optional[str] = None,
+        ttl: float = 300,
+        key: str = "",
+        on_snapshot: Optional[Callable[[List[Alias], dict], None]] = None,
+        retry_after: float = 5.0,
+    ):
+        """Maps hme -> anonymousId from a single `/v2/hme/list` snapshot.
+
+        Concurrent lookups share one in-flight fetch, so a bulk operation costs
+        one list call no matter how many emails it touches.
+
+        Args:
+            fetch (callable)    Coroutine returning the raw `list_email` response
+            cache_file (str)    Optional path to keep the index on disk between runs
+            ttl (float)         Seconds a cached index stays valid
+            key (str)           Account identifier, a cached index of another account is ignored
+            on_snapshot (callable)  Called with the aliases and response of every fetched snapshot
+            retry_after (float) Seconds a failed fetch is answered with an empty index before the next try
+        """
+        self._fetch = fetch
+        self._on_snapshot = on_snapshot
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._key = hashlib.sha256(key.encode()).hexdigest()
+        self._index: Optional[Dict[str, str]] = None
+        self._pending: Optional[asyncio.Future] = None
+        self._from_cache = False
+        self._created = 0.0
+        self._failed_at = 0.0
+        # last failed `list_email` response, if any
+        self.error: Optional[dict] = None
+
+    async def get(self, hme: str) -> Optional[str]:
+        index = await self.load()
+        if hme not in index and self._stale():
+            # the snapshot may predate this email, fetch a fresh one once
+            index = await self.refresh()
+        return index.get(hme)
+
+    def _stale(self) -> bool:
+        if self.error is not None:
+            # a short pause, so one batch does not refetch per email
+            return time.time() - self._failed_at > self.retry_after
+        return self._from_cache or time.time() - self._created > self.ttl
+
+    async def load(self) -> Dict[str, str]:
+        if self._index is not None:
+            return self._index
+        cached = self._read_cache()
+        if cached is not None:
+            self._index, self._from_cache = cached, True
+            return cached
+        return await self.refresh()
+
+    async def refresh(self) -> Dict[str, str]:
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._build())
+        pending = self._pending
+        try:
+            return await asyncio.shield(pending)
+        finally:
+            if pending.done() and self._pending is pending:
+                self._pending = None
+
+    def add(self, hme: str, anonymous_id: str) -> None:
+        """Records a newly reserved email without refetching"""
+        if self._index is not None:
+            self._index[hme] = anonymous_id
+            self._write_cache()
+
+    def discard(self, hme: str) -> None:
+        """Drops a deleted email from the index"""
+        if self._index is not None and self._index.pop(hme, None) is not None:
+            self._write_cache()
+
+    async def _build(self) -> Dict[str, str]:
+        res = await self._fetch()
+        aliases = parse_aliases(res)
+        if aliases is None:
+            # keep an empty index so the rest of the batch does not refetch
+            self.error = res or {"error": 1, "reason": "Empty response"}
+            self._index, self._from_cache = {}, False
+            self._failed_at = time.time()
+            return self._index
+        if self._on_snapshot is not None:
+            self._on_snapshot(aliases, res)
+        index = {alias.hme: alias.anonymous_id for alias in aliases}
+        self.error = None
+        self._index, self._from_cache = index, False
+        self._created = time.time()
+        self._write_cache()
+        return index
+
+    def _read_cache(self) -> Optional[Dict[str, str]]:
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != self._key:
+            return None
+        if time.time() - data.get("created", 0) > self.ttl:
+            return None
+        self._created = data["created"]
+        return data.get("index")
+
+    def _write_cache(self) -> None:
+        if not self.cache_file:
+            return
+        tmp = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"key": self._key, "created": self._created, "index": self._index},
+                    f,
+                )
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            pass
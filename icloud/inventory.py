@@ -0,0 +1,322 @@
+import re
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .records import Alias
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS aliases (
+    account TEXT NOT NULL,
+    hme TEXT NOT NULL,
+    anonymous_id TEXT,
+    label TEXT NOT NULL DEFAULT '',
+    note TEXT NOT NULL DEFAULT '',
+    is_active INTEGER NOT NULL DEFAULT 1,
+    create_timestamp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, hme)
+);
+CREATE INDEX IF NOT EXISTS aliases_label ON aliases (account, label);
+CREATE INDEX IF NOT EXISTS aliases_active ON aliases (account, is_active);
+CREATE INDEX IF NOT EXISTS aliases_created ON aliases (account, create_timestamp);
+CREATE TABLE IF NOT EXISTS pool (
+    account TEXT NOT NULL,
+    hme TEXT NOT NULL,
+    anonymous_id TEXT,
+    create_timestamp INTEGER NOT NULL DEFAULT 0,
+    added_at REAL NOT NULL,
+    PRIMARY KEY (account, hme)
+);
+CREATE INDEX IF NOT EXISTS pool_added ON pool (account, added_at);
+CREATE TABLE IF NOT EXISTS reservations (
+    account TEXT NOT NULL,
+    hme TEXT NOT NULL,
+    reserved_at REAL NOT NULL,
+    PRIMARY KEY (account, hme)
+);
+CREATE INDEX IF NOT EXISTS reservations_at ON reservations (account, reserved_at);
+CREATE TABLE IF NOT EXISTS syncs (
+    account TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    identity TEXT
+);
+"""
+# tables holding per-account rows, cleared when an account's identity changes
+ACCOUNT_TABLES = ("aliases", "pool", "reservations")
+
+COLUMNS = ("hme", "anonymous_id", "label", "note", "is_active", "create_timestamp")
+
+
+class Inventory:
+    def __init__(self, path: str, account: str = ""):
+        """Local SQLite copy of an account's aliases.
+
+        Rows are keyed by `account`, a name picked locally. `sync` also records
+        who the list belongs to, so callers can `reset` the rows of the previous
+        Apple ID when the same name starts pointing at another one.
+
+        Args:
+            path (str)      SQLite database file, shared by all accounts
+            account (str)   Account the rows belong to
+        """
+        self.path = path
+        self.account = account
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(syncs)")}
+        if "identity" not in columns:
+            # databases created before identities were recorded
+            self.conn.execute("ALTER TABLE syncs ADD COLUMN identity TEXT")
+        self._patterns: Dict[str, "re.Pattern"] = {}
+        self.conn.create_function("REGEXP", 2, self._regexp, deterministic=True)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _pattern(self, pattern: str) -> "re.Pattern":
+        compiled = self._patterns.get(pattern)
+        if compiled is None:
+            compiled = self._patterns[pattern] = re.compile(pattern, re.IGNORECASE)
+        return compiled
+
+    def _regexp(self, pattern: str, value: Optional[str]) -> bool:
+        return value is not None and self._pattern(pattern).search(value) is not None
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT synced_at FROM syncs WHERE account = ?", (self.account,)
+        ).fetchone()
+        return row[0] if row else None
+
+    @property
+    def identity(self) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT identity FROM syncs WHERE account = ?", (self.account,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def sync(
+        self, aliases: Iterable[Alias], identity: Optional[str] = None
+    ) -> Dict[str, int]:
+        """Brings the stored rows in line with a `/v2/hme/list` snapshot.
+
+        Only rows that were added, changed or removed are written. Pooled
+        aliases missing from the snapshot are dropped from the pool, unless
+        they are newer than every alias in it and may just not be listed yet.
+        `identity` replaces the recorded one, the previous one is kept when None.
+        """
+        previous = self.identity
+        stored = {
+            row[0]: row
+            for row in self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM aliases WHERE account = ?",
+                (self.account,),
+            )
+        }
+        upserts: List[tuple] = []
+        seen = set()
+        newest = 0
+        for alias in aliases:
+            row = alias.as_row()
+            seen.add(row[0])
+            newest = max(newest, alias.create_timestamp)
+            if stored.get(row[0]) != row:
+                upserts.append(row)
+        removed = [(self.account, hme) for hme in stored.keys() - seen]
+        pruned = [
+            (self.account, row[0])
+            for row in self.conn.execute(
+                "SELECT hme FROM pool WHERE account = ? AND create_timestamp <= ?",
+                (self.account, newest),
+            )
+            if row[0] not in seen
+        ]
+        with self.conn:
+            self._upsert(upserts)
+            self.conn.executemany(
+                "DELETE FROM aliases WHERE account = ? AND hme = ?", removed
+            )
+            self.conn.executemany(
+                "DELETE FROM pool WHERE account = ? AND hme = ?", pruned
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO syncs (account, synced_at, identity) "
+                "VALUES (?, ?, ?)",
+                (self.account, time.time(), identity or previous),
+            )
+        added = sum(1 for row in upserts if row[0] not in stored)
+        return {
+            "added": added,
+            "updated": len(upserts) - added,
+            "removed": len(removed),
+            "pruned": len(pruned),
+        }
+
+    def reset(self) -> List[str]:
+        """Drops every row of the account, returns the pooled aliases that were dropped"""
+        pooled = [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT hme FROM pool WHERE account = ? ORDER BY added_at",
+                (self.account,),
+            )
+        ]
+        with self.conn:
+            for table in ACCOUNT_TABLES:
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE account = ?", (self.account,)
+                )
+        return pooled
+
+    def _upsert(self, rows: List[tuple]) -> None:
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO aliases (account, {', '.join(COLUMNS)}) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(self.account, *row) for row in rows],
+        )
+
+    def upsert(self, alias: Alias) -> None:
+        with self.conn:
+            self._upsert([alias.as_row()])
+
+    def set_active(self, hme: str, active: bool) -> None:
+        with self.conn:
+            self.conn.execute(
+                "UPDATE aliases SET is_active = ? WHERE account = ? AND hme = ?",
+                (int(active), self.account, hme),
+            )
+
+    def set_metadata(self, hme: str, label: str, note: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "UPDATE aliases SET label = ?, note = ? WHERE account = ? AND hme = ?",
+                (label, note, self.account, hme),
+            )
+
+    def remove(self, hme: str) -> None:
+        with self.conn:
+            for table in ("aliases", "pool"):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE account = ? AND hme = ?",
+                    (self.account, hme),
+                )
+
+    def iter_search(
+        self,
+        active: Optional[bool] = None,
+        label: Optional[str] = None,
+        note: Optional[str] = None,
+        hme: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Iterator[Alias]:
+        """Streams matching aliases, newest first, straight off the cursor.
+
+        Args:
+            active (bool)   Only active or only inactive aliases, None for both
+            label (str)     Case-insensitive regex the label must match
+            note (str)      Same for the note
+            hme (str)       Same for the address
+            since (int)     Created at or after, milliseconds since epoch
+            until (int)     Created before, milliseconds since epoch
+            limit (int)     Rows to return, None for all
+            offset (int)    Matching rows to skip first
+
+        Raises `re.error` for an invalid regex before any row is read.
+        """
+        query = f"SELECT {', '.join(COLUMNS)} FROM aliases WHERE account = ?"
+        args: list = [self.account]
+        if active is not None:
+            query += " AND is_active = ?"
+            args.append(int(active))
+        for column, pattern in (("label", label), ("note", note), ("hme", hme)):
+            if pattern is not None:
+                # compiled once here, every row reuses it
+                self._pattern(pattern)
+                query += f" AND {column} REGEXP ?"
+                args.append(pattern)
+        if since is not None:
+            query += " AND create_timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            query += " AND create_timestamp < ?"
+            args.append(until)
+        query += " ORDER BY create_timestamp DESC LIMIT ? OFFSET ?"
+        args += [-1 if limit is None else limit, offset]
+        for row in self.conn.execute(query, args):
+            yield Alias.from_row(row)
+
+    def search(self, active: Optional[bool] = None, **filters) -> List[Alias]:
+        """All aliases matching the filters of `iter_search`"""
+        return [*self.iter_search(active, **filters)]
+
+    def record_reservation(self, hme: str, reserved_at: Optional[float] = None) -> None:
+        """Remembers when an alias was reserved, it counts against the quota even once deleted"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO reservations (account, hme, reserved_at) "
+                "VALUES (?, ?, ?)",
+                (
+                    self.account,
+                    hme,
+                    time.time() if reserved_at is None else reserved_at,
+                ),
+            )
+
+    def reservation_times(self, since: float) -> List[float]:
+        """Reservations at or after `since`, in seconds since epoch.
+
+        Recorded reservations plus aliases created elsewhere, e.g. on a phone,
+        as far as the last sync knows them.
+        """
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT reserved_at FROM reservations "
+                "WHERE account = ? AND reserved_at >= ? "
+                "UNION ALL "
+                "SELECT create_timestamp / 1000.0 FROM aliases "
+                "WHERE account = ? AND create_timestamp >= ? AND hme NOT IN "
+                "(SELECT hme FROM reservations WHERE account = ?)",
+                (self.account, since, self.account, since * 1000, self.account),
+            )
+        ]
+
+    def pool_size(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM pool WHERE account = ?", (self.account,)
+        ).fetchone()[0]
+
+    def pool_add(self, alias: Alias) -> None:
+        """Parks a reserved, not yet handed out alias in the reservoir"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pool "
+                "(account, hme, anonymous_id, create_timestamp, added_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.account,
+                    alias.hme,
+                    alias.anonymous_id,
+                    alias.create_timestamp,
+                    time.time(),
+                ),
+            )
+
+    def pool_pop(self) -> Optional[Alias]:
+        """Takes the oldest alias out of the reservoir"""
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT hme, anonymous_id, create_timestamp FROM pool "
+                "WHERE account = ? ORDER BY added_at LIMIT 1",
+                (self.account,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "DELETE FROM pool WHERE account = ? AND hme = ?", (self.account, row[0])
+            )
+        return Alias(row[0], row[1], create_timestamp=row[2])
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+import uuid
+from typing import List, Optional
+
+
+class JournalState:
+    """What a journal says about its latest run"""
+
+    def __init__(self):
+        self.run: Optional[str] = None
+        self.target = 0
+        self.label: Optional[str] = None
+        self.notes: Optional[str] = None
+        # reserved emails, in order
+        self.reserved: List[str] = []
+        # reserved emails not yet written to the output file
+        self.unsaved: List[str] = []
+        # generated emails that were never reserved, including failed ones
+        self.pending: List[str] = []
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.target - len(self.reserved))
+
+
+class GenerationJournal:
+    def __init__(self, path: str, fsync_every: int = 16, fsync_interval: float = 1.0):
+        """Append-only JSON lines record of aliases moving through generated -> reserved.
+
+        Every event is flushed to the OS right away so a crash of the process loses
+        nothing; `fsync` is batched every `fsync_every` events or `fsync_interval`
+        seconds to survive power loss without paying for it on every line.
+
+        Args:
+            path (str)              Journal file
+            fsync_every (int)       Events between two fsync calls
+            fsync_interval (float)  Seconds between two fsync calls
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.run: Optional[str] = None
+        self._f = open(path, "a+", encoding="utf-8")
+        if self._f.tell():
+            # terminate a line torn by a crash so the next record stays parseable
+            self._f.seek(self._f.tell() - 1)
+            if self._f.read(1) != "\n":
+                self._f.write("\n")
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def __enter__(self) -> "GenerationJournal":
+        return self
+
+    def __exit__(self, exc_t, exc_v, exc_tb) -> None:
+        self.close()
+
+    def _write(self, event: str, **fields) -> None:
+        record = {"event": event, "run": self.run, "ts": time.time(), **fields}
+        self._f.write(json.dumps(record) + "\n")
+        self._f.flush()
+        self._unsynced += 1
+        if (
+            self._unsynced >= self.fsync_every
+            or time.monotonic() - self._synced_at >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        if self._unsynced:
+            os.fsync(self._f.fileno())
+            self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+    def start(self, target: int, label: Optional[str], notes: Optional[str]) -> None:
+        self.run = uuid.uuid4().hex
+        self._write("run", target=target, label=label, notes=notes)
+
+    def resume(self, run: str) -> None:
+        self.run = run
+        self._write("resume")
+
+    def generated(self, email: str) -> None:
+        self._write("generated", hme=email)
+
+    def reserved(self, email: str) -> None:
+        self._write("reserved", hme=email)
+
+    def failed(self, email: str) -> None:
+        self._write("failed", hme=email)
+
+    def saved(self) -> None:
+        """Marks every reserved email so far as written to the output file"""
+        self._write("saved")
+
+    @staticmethod
+    def load(path: str) -> JournalState:
+        state = JournalState()
+        if not os.path.exists(path):
+            return state
+        pending = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line after a crash
+                    continue
+                event, hme = record.get("event"), record.get("hme")
+                if event == "run":
+                    state = JournalState()
+                    pending = {}
+                    state.run = record["run"]
+                    state.target = record.get("target", 0)
+                    state.label = record.get("label")
+                    state.notes = record.get("notes")
+                elif record.get("run") != state.run:
+                    continue
+                elif event == "generated":
+                    pending[hme] = None
+                elif event == "reserved":
+                    pending.pop(hme, None)
+                    state.reserved.append(hme)
+                    state.unsaved.append(hme)
+                elif event == "saved":
+                    state.unsaved = []
+        state.pending = list(pending)
+        return state
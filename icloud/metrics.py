@@ -0,0 +1,183 @@
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+# latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Per-endpoint request instrumentation.
+
+    Tracks a latency histogram, response status and outcome counters, in-flight
+    gauges and bytes received for every endpoint, exportable as Prometheus text
+    or JSON.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.statuses: Counter = Counter()
+        self.outcomes: Counter = Counter()
+        self.in_flight: Counter = Counter()
+        self.max_in_flight: Counter = Counter()
+        self.bytes_received: Counter = Counter()
+        self.retries: Counter = Counter()
+
+    def start(self, endpoint: str) -> float:
+        self.in_flight[endpoint] += 1
+        self.max_in_flight[endpoint] = max(
+            self.max_in_flight[endpoint], self.in_flight[endpoint]
+        )
+        return time.perf_counter()
+
+    def finish(
+        self,
+        endpoint: str,
+        started: float,
+        outcome: str,
+        status: Optional[int] = None,
+        nbytes: int = 0,
+    ) -> None:
+        """Records a finished request.
+
+        Args:
+            endpoint (str)  Endpoint name, e.g. `generate`
+            started (float) Value returned by `start`
+            outcome (str)   `ok`, `throttled`, `quota`, `api_error`, `cancelled` or the exception class name
+            status (int)    HTTP status, None if no response was received
+            nbytes (int)    Size of the response body
+        """
+        self.in_flight[endpoint] -= 1
+        self.latency[endpoint].observe(time.perf_counter() - started)
+        self.outcomes[(endpoint, outcome)] += 1
+        if status is not None:
+            self.statuses[(endpoint, status)] += 1
+        self.bytes_received[endpoint] += nbytes
+
+    def retry(self, endpoint: str) -> None:
+        self.retries[endpoint] += 1
+
+    def to_dict(self) -> dict:
+        endpoints = {}
+        for endpoint, hist in sorted(self.latency.items()):
+            endpoints[endpoint] = {
+                "requests": hist.count,
+                "latency_seconds": {
+                    "mean": round(hist.sum / hist.count, 4) if hist.count else 0.0,
+                    "p50": round(hist.quantile(0.5), 4),
+                    "p90": round(hist.quantile(0.9), 4),
+                    "p99": round(hist.quantile(0.99), 4),
+                    "max": round(hist.max, 4),
+                },
+                "outcomes": _by_endpoint(self.outcomes, endpoint),
+                "statuses": _by_endpoint(self.statuses, endpoint),
+                "in_flight": self.in_flight[endpoint],
+                "max_in_flight": self.max_in_flight[endpoint],
+                "bytes_received": self.bytes_received[endpoint],
+                "retries": self.retries[endpoint],
+            }
+        return {
+            "duration_seconds": round(time.time() - self.started, 3),
+            "endpoints": endpoints,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP hme_request_duration_seconds Request latency by endpoint",
+            "# TYPE hme_request_duration_seconds histogram",
+        ]
+        for endpoint, hist in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'hme_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}'
+                )
+            lines.append(
+                f'hme_request_duration_seconds_sum{{endpoint="{endpoint}"}} {hist.sum}'
+            )
+            lines.append(
+                f'hme_request_duration_seconds_count{{endpoint="{endpoint}"}} {hist.count}'
+            )
+        lines += [
+            "# HELP hme_requests_total Finished requests by endpoint and outcome",
+            "# TYPE hme_requests_total counter",
+        ]
+        for (endpoint, outcome), n in sorted(self.outcomes.items()):
+            lines.append(
+                f'hme_requests_total{{endpoint="{endpoint}",outcome="{outcome}"}} {n}'
+            )
+        lines += [
+            "# HELP hme_responses_total Responses by endpoint and HTTP status",
+            "# TYPE hme_responses_total counter",
+        ]
+        for (endpoint, status), n in sorted(self.statuses.items()):
+            lines.append(
+                f'hme_responses_total{{endpoint="{endpoint}",status="{status}"}} {n}'
+            )
+        lines += [
+            "# HELP hme_requests_in_flight Requests currently in flight",
+            "# TYPE hme_requests_in_flight gauge",
+        ]
+        for endpoint, n in sorted(self.in_flight.items()):
+            lines.append(f'hme_requests_in_flight{{endpoint="{endpoint}"}} {n}')
+        lines += [
+            "# HELP hme_received_bytes_total Response body bytes received",
+            "# TYPE hme_received_bytes_total counter",
+        ]
+        for endpoint, n in sorted(self.bytes_received.items()):
+            lines.append(f'hme_received_bytes_total{{endpoint="{endpoint}"}} {n}')
+        lines += [
+            "# HELP hme_retries_total Requests retried after a transient failure",
+            "# TYPE hme_retries_total counter",
+        ]
+        for endpoint, n in sorted(self.retries.items()):
+            lines.append(f'hme_retries_total{{endpoint="{endpoint}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Writes JSON when `path` ends with .json, Prometheus text otherwise"""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump(self.to_dict(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+
+def _by_endpoint(counter: Counter, endpoint: str) -> Dict[str, int]:
+    return {
+        str(key): n for (name, key), n in sorted(counter.items()) if name == endpoint
+    }
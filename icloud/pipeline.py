@@ -0,0 +1,169 @@
+import asyncio
+import inspect
+from typing import Any, Callable, Iterable, List, Optional
+
+from .hidemyemail import HideMyEmail
+from .ratelimit import is_quota_exhausted
+
+
+class GenerationPipeline:
+    def __init__(
+        self,
+        client: HideMyEmail,
+        count: int,
+        generate_concurrency: int = 5,
+        reserve_concurrency: int = 5,
+        queue_size: Optional[int] = None,
+        max_failed_attempts: int = 10,
+        candidates: Iterable[str] = (),
+        on_generated: Optional[Callable[[str], Any]] = None,
+        on_reserved: Optional[Callable[[str, dict], Any]] = None,
+        on_failed: Optional[Callable[[str, Optional[dict], str], Any]] = None,
+    ):
+        """Two-stage generate -> reserve pipeline.
+
+        Generate workers push candidates onto a bounded queue that a separately
+        sized pool of reserve workers drains, so each endpoint is kept busy on its
+        own and throughput is limited by the slower one. New candidates are only
+        generated while `count` is not covered by reserved + queued + in-flight.
+
+        Args:
+            client (HideMyEmail)        Entered client used for both endpoints
+            count (int)                 How many emails to reserve
+            generate_concurrency (int)  Generate requests kept in flight
+            reserve_concurrency (int)   Reserve requests kept in flight
+            queue_size (int)            Candidates buffered between stages, defaults to 2 * reserve_concurrency
+            max_failed_attempts (int)   Stop generating after this many failures in a row
+            candidates (iterable)       Already generated emails to reserve first
+            on_generated (callable)     Called with each generated email
+            on_reserved (callable)      Called with each reserved email and the reserve response
+            on_failed (callable)        Called with stage ("generate" or "reserve"), response and email
+        """
+        self.client = client
+        self.count = count
+        self.generate_concurrency = max(1, generate_concurrency)
+        self.reserve_concurrency = max(1, reserve_concurrency)
+        self.max_failed_attempts = max_failed_attempts
+        self.on_generated = on_generated
+        self.on_reserved = on_reserved
+        self.on_failed = on_failed
+
+        seeds = list(candidates)
+        self._queue: asyncio.Queue = asyncio.Queue(
+            (queue_size or 2 * self.reserve_concurrency) + len(seeds)
+        )
+        for email in seeds:
+            self._queue.put_nowait(email)
+        self._changed = asyncio.Condition()
+        self._generating = 0
+        self._reserving = 0
+        self._failed_in_row = 0
+        # set once Apple refuses for quota, nothing more can be created in this run
+        self.quota_exhausted = False
+
+        # reserved emails, in reservation order
+        self.reserved: List[str] = []
+        # generated candidates that could not be reserved
+        self.unreserved: List[str] = []
+
+    @property
+    def stopped(self) -> bool:
+        return (
+            len(self.reserved) >= self.count
+            or self._failed_in_row >= self.max_failed_attempts
+            or self.quota_exhausted
+        )
+
+    def _needed(self) -> int:
+        return (
+            self.count
+            - len(self.reserved)
+            - self._queue.qsize()
+            - self._reserving
+            - self._generating
+        )
+
+    async def _emit(self, callback: Optional[Callable], *args) -> None:
+        if callback is None:
+            return
+        res = callback(*args)
+        if inspect.isawaitable(res):
+            await res
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _generate_worker(self) -> None:
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.stopped or self._needed() > 0)
+                if self.stopped:
+                    return
+                self._generating += 1
+            try:
+                res = await self.client.generate_email()
+                try:
+                    email = res["result"]["hme"]
+                except (KeyError, TypeError):
+                    self._failed_in_row += 1
+                    self.quota_exhausted |= is_quota_exhausted(res)
+                    await self._emit(self.on_failed, "generate", res, "")
+                    continue
+                self._failed_in_row = 0
+                await self._emit(self.on_generated, email)
+                # blocks while the reserve stage is behind
+                await self._queue.put(email)
+            finally:
+                self._generating -= 1
+                await self._notify()
+
+    async def _reserve_worker(self) -> None:
+        while True:
+            email = await self._queue.get()
+            if email is None:
+                return
+            if len(self.reserved) >= self.count or self.quota_exhausted:
+                self.unreserved.append(email)
+                continue
+            self._reserving += 1
+            try:
+                await self._reserve(email)
+            finally:
+                self._reserving -= 1
+                await self._notify()
+
+    async def _reserve(self, email: str) -> None:
+        # transient failures are already retried by the client's reserve policy
+        res = await self.client.reserve_email(email)
+        if res and res.get("success"):
+            self._failed_in_row = 0
+            self.reserved.append(email)
+            await self._emit(self.on_reserved, email, res)
+            return
+        self._failed_in_row += 1
+        self.quota_exhausted |= is_quota_exhausted(res)
+        self.unreserved.append(email)
+        await self._emit(self.on_failed, "reserve", res, email)
+
+    async def run(self) -> List[str]:
+        """Runs until `count` emails are reserved or generation keeps failing"""
+        reservers = [
+            asyncio.create_task(self._reserve_worker())
+            for _ in range(self.reserve_concurrency)
+        ]
+        generators = [
+            asyncio.create_task(self._generate_worker())
+            for _ in range(self.generate_concurrency)
+        ]
+        try:
+            await asyncio.gather(*generators)
+            for _ in reservers:
+                await self._queue.put(None)
+            await asyncio.gather(*reservers)
+        finally:
+            for task in generators + reservers:
+                task.cancel()
+            # let cancelled requests unwind before the caller goes on
+            await asyncio.gather(*generators, *reservers, return_exceptions=True)
+        return self.reserved
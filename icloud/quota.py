@@ -0,0 +1,152 @@
+import time
+from collections import deque
+from typing import Iterable, List, NamedTuple, Optional
+
+from .records import Alias
+
+# Apple lets an account create about 5 aliases per family member every 30 mins
+# and caps the total at roughly 700
+WINDOW_QUOTA = 5
+WINDOW_SECONDS = 30 * 60
+LIFETIME_CAP = 700
+
+
+class AccountQuota(NamedTuple):
+    total: int
+    recent: int
+    window_quota: int = WINDOW_QUOTA
+    lifetime_cap: int = LIFETIME_CAP
+
+    @property
+    def lifetime_remaining(self) -> int:
+        return max(0, self.lifetime_cap - self.total)
+
+    @property
+    def window_remaining(self) -> int:
+        return min(self.lifetime_remaining, max(0, self.window_quota - self.recent))
+
+
+def account_quota(
+    aliases: Optional[List[Alias]],
+    now: Optional[float] = None,
+    window_quota: int = WINDOW_QUOTA,
+    lifetime_cap: int = LIFETIME_CAP,
+    window_seconds: float = WINDOW_SECONDS,
+) -> Optional[AccountQuota]:
+    """Estimates the remaining quota of an account from its aliases"""
+    if aliases is None:
+        return None
+    since = ((now or time.time()) - window_seconds) * 1000
+    recent = sum(1 for alias in aliases if alias.create_timestamp >= since)
+    return AccountQuota(len(aliases), recent, window_quota, lifetime_cap)
+
+
+def allocate(count: int, quotas: List[Optional[AccountQuota]]) -> List[int]:
+    """Splits `count` across accounts without waiting for their windows.
+
+    No account gets more than its rolling window has room for right now, the
+    accounts with the most room left go first and ties go to the most lifetime
+    quota left. Accounts with an unknown quota get nothing, so the sum may be
+    lower than `count`.
+    """
+    shares = [0] * len(quotas)
+    for _ in range(count):
+        best, best_key = None, None
+        for i, quota in enumerate(quotas):
+            if quota is None or shares[i] >= quota.window_remaining:
+                continue
+            key = (
+                quota.window_remaining - shares[i],
+                quota.lifetime_remaining - shares[i],
+            )
+            if best_key is None or key > best_key:
+                best, best_key = i, key
+        if best is None:
+            break
+        shares[best] += 1
+    return shares
+
+
+def window_opens(
+    timestamps: Iterable[float],
+    now: float,
+    window_quota: int = WINDOW_QUOTA,
+    window_seconds: float = WINDOW_SECONDS,
+) -> float:
+    """When the rolling window next has room for a reservation, `now` if it has.
+
+    Args:
+        timestamps (iterable)   Seconds since epoch of the account's past reservations
+        now (float)             Current time
+    """
+    recent = sorted(t for t in timestamps if t > now - window_seconds)
+    if len(recent) < window_quota:
+        return now
+    # the window frees up once enough of the oldest reservations age out of it
+    return recent[len(recent) - window_quota] + window_seconds
+
+
+def finish_eta(
+    count: int,
+    timestamps: Iterable[float],
+    now: float,
+    window_quota: int = WINDOW_QUOTA,
+    window_seconds: float = WINDOW_SECONDS,
+) -> float:
+    """Earliest time `count` more reservations can be done, each at its first free slot"""
+    window_quota = max(1, window_quota)
+    # only the last `window_quota` reservations can hold up the next one
+    last = deque(
+        sorted(t for t in timestamps if t > now - window_seconds)[-window_quota:],
+        maxlen=window_quota,
+    )
+    at = now
+    for _ in range(count):
+        if len(last) == window_quota:
+            at = max(at, last[0] + window_seconds)
+        last.append(at)
+    return at
+
+
+def allocate_over_time(
+    count: int,
+    quotas: List[Optional[AccountQuota]],
+    timestamps: List[List[float]],
+    now: float,
+    window_quota: int = WINDOW_QUOTA,
+    window_seconds: float = WINDOW_SECONDS,
+) -> List[int]:
+    """Splits `count` across accounts that wait out their rolling windows.
+
+    Each alias goes to the account with the earliest free slot, so the last one
+    is reserved as early as possible. Ties go to the account with the most
+    lifetime quota left, accounts with an unknown quota get nothing.
+
+    Args:
+        timestamps (list)   Past reservation times of each account, as for `window_opens`
+    """
+    window_quota = max(1, window_quota)
+    shares = [0] * len(quotas)
+    lasts = [
+        deque(
+            sorted(t for t in times if t > now - window_seconds)[-window_quota:],
+            maxlen=window_quota,
+        )
+        for times in timestamps
+    ]
+    for _ in range(count):
+        best, best_key = None, None
+        for i, quota in enumerate(quotas):
+            if quota is None or shares[i] >= quota.lifetime_remaining:
+                continue
+            slot = now
+            if len(lasts[i]) == window_quota:
+                slot = max(now, lasts[i][0] + window_seconds)
+            key = (slot, shares[i] - quota.lifetime_remaining)
+            if best_key is None or key < best_key:
+                best, best_key = i, key
+        if best is None:
+            break
+        shares[best] += 1
+        lasts[best].append(best_key[0])
+    return shares
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Optional
+
+# substrings of Apple error messages returned when requests are being throttled
+THROTTLE_MARKERS = ("rate limit", "too many", "throttl")
+THROTTLE_STATUSES = (429, 503)
+# Apple's hard quota reply, "You have reached the limit of addresses you can
+# create at this time. Try again later." Waiting seconds does not help with it.
+QUOTA_MARKERS = ("reached the limit of addresses",)
+
+
+def _reason(res: Optional[dict]) -> str:
+    if not res or res.get("success"):
+        return ""
+    error = res.get("error", {})
+    reason = (
+        res.get("reason", "")
+        if isinstance(error, int)
+        else error.get("errorMessage", "") or ""
+    )
+    return reason.lower()
+
+
+def is_quota_exhausted(res: Optional[dict]) -> bool:
+    """Tells whether a response is the account's address quota running out"""
+    reason = _reason(res)
+    return any(marker in reason for marker in QUOTA_MARKERS)
+
+
+def is_throttled(status: Optional[int], res: Optional[dict]) -> bool:
+    """Tells whether a response means the account/IP is being rate limited"""
+    if status in THROTTLE_STATUSES:
+        return True
+    if is_quota_exhausted(res):
+        return False
+    reason = _reason(res)
+    return any(marker in reason for marker in THROTTLE_MARKERS)
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        rate: float = 5.0,
+        min_rate: float = 0.1,
+        max_rate: float = 50.0,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        """Token bucket whose refill rate follows AIMD.
+
+        Every successful response adds `increase` requests/s to the rate, every
+        throttled response multiplies it by `decrease`. Throttles that arrive
+        within `cooldown` seconds of the last decrease are counted once, so a burst
+        of concurrent failures does not collapse the rate.
+
+        Args:
+            rate (float)        Initial requests per second
+            min_rate (float)    Lower bound of the rate
+            max_rate (float)    Upper bound of the rate
+            increase (float)    Additive increase per success
+            decrease (float)    Multiplicative decrease per throttle
+            cooldown (float)    Seconds between two decreases
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._rate = min(max(rate, min_rate), max_rate)
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        self.throttled = 0
+
+    @property
+    def rate(self) -> float:
+        """Current requests per second"""
+        return self._rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        # burst is capped at one second worth of requests
+        self._tokens = min(
+            max(1.0, self._rate), self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def on_success(self) -> None:
+        self._refill()
+        self._rate = min(self.max_rate, self._rate + self.increase)
+
+    def on_throttle(self) -> None:
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._refill()
+        self._last_decrease = now
+        self._rate = max(self.min_rate, self._rate * self.decrease)
+        self._tokens = 0.0
@@ -0,0 +1,164 @@
+import asyncio
+import inspect
+import json
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .hidemyemail import HideMyEmail
+from .records import Alias
+
+STATES = ("active", "inactive", "deleted")
+# what happens to aliases the desired state does not mention
+UNLISTED = ("keep", "deactivate", "delete")
+
+
+class DesiredAlias(NamedTuple):
+    hme: str
+    # None leaves the current value alone
+    state: Optional[str] = None
+    label: Optional[str] = None
+    note: Optional[str] = None
+
+
+class DesiredState(NamedTuple):
+    aliases: Dict[str, DesiredAlias]
+    unlisted: str = "keep"
+
+
+class Change(NamedTuple):
+    """Steps bringing one alias in line, run in order"""
+
+    hme: str
+    anonymous_id: str
+    # subset of ("update", "deactivate", "reactivate", "delete")
+    actions: Tuple[str, ...]
+    label: str = ""
+    note: str = ""
+
+
+class Plan(NamedTuple):
+    changes: List[Change]
+    # desired aliases the account does not have, they can not be created by address
+    missing: List[str]
+    unchanged: int
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for change in self.changes:
+            for action in change.actions:
+                counts[action] = counts.get(action, 0) + 1
+        return counts
+
+
+def load_desired(path: str) -> DesiredState:
+    """Reads a desired-state file.
+
+    Either a list of entries or `{"unlisted": "keep", "aliases": [...]}`, where an
+    entry is `{"hme": ..., "state": "active" | "inactive" | "deleted", "label": ..., "note": ...}`
+    and every key but `hme` is optional.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"aliases": data}
+    unlisted = data.get("unlisted", "keep")
+    if unlisted not in UNLISTED:
+        raise ValueError(f"unlisted must be one of {', '.join(UNLISTED)}")
+    aliases = {}
+    for entry in data.get("aliases", []):
+        if isinstance(entry, str):
+            entry = {"hme": entry}
+        hme = (entry.get("hme") or "").strip()
+        if not hme:
+            raise ValueError(f"entry without hme: {entry!r}")
+        state = entry.get("state")
+        if state is not None and state not in STATES:
+            raise ValueError(f"{hme}: state must be one of {', '.join(STATES)}")
+        aliases[hme] = DesiredAlias(hme, state, entry.get("label"), entry.get("note"))
+    return DesiredState(aliases, unlisted)
+
+
+def plan(desired: DesiredState, aliases: Iterable[Alias]) -> Plan:
+    """Diffs the desired state against one list snapshot, emitting only needed steps"""
+    changes: List[Change] = []
+    seen = set()
+    unchanged = 0
+    for alias in aliases:
+        seen.add(alias.hme)
+        want = desired.aliases.get(alias.hme)
+        if want is None:
+            want = DesiredAlias(
+                alias.hme,
+                {"keep": None, "deactivate": "inactive", "delete": "deleted"}[
+                    desired.unlisted
+                ],
+            )
+        label = alias.label if want.label is None else want.label
+        note = alias.note if want.note is None else want.note
+        actions: List[str] = []
+        if want.state == "deleted":
+            actions.append("delete")
+        else:
+            if (label, note) != (alias.label, alias.note):
+                actions.append("update")
+            if want.state == "inactive" and alias.is_active:
+                actions.append("deactivate")
+            elif want.state == "active" and not alias.is_active:
+                actions.append("reactivate")
+        if not actions:
+            unchanged += 1
+            continue
+        changes.append(
+            Change(alias.hme, alias.anonymous_id or "", tuple(actions), label, note)
+        )
+    missing = [
+        hme
+        for hme, want in desired.aliases.items()
+        if hme not in seen and want.state != "deleted"
+    ]
+    return Plan(changes, missing, unchanged)
+
+
+async def apply(
+    client: HideMyEmail,
+    plan: Plan,
+    concurrency: int = 10,
+    on_result: Optional[Callable[[Change, Optional[str], Optional[dict]], Any]] = None,
+) -> List[Tuple[Change, Optional[str], Optional[dict]]]:
+    """Runs a plan with at most `concurrency` aliases in flight.
+
+    The steps of one alias run in order and stop at the first failure.
+
+    Args:
+        client (HideMyEmail)    Entered client
+        plan (Plan)             Output of `plan`
+        concurrency (int)       Aliases changed at once
+        on_result (callable)    Called with each change, the failed action (None on success) and its response
+
+    Returns a `(change, failed action, response)` tuple per change.
+    """
+    steps = {
+        "update": lambda c: client.update_metadata(c.anonymous_id, c.label, c.note),
+        "deactivate": lambda c: client.deactivate_email(c.anonymous_id),
+        "reactivate": lambda c: client.reactivate_email(c.anonymous_id),
+        "delete": lambda c: client.delete_email(c.anonymous_id),
+    }
+    results: List[Tuple[Change, Optional[str], Optional[dict]]] = []
+    pending = iter(plan.changes)
+
+    async def worker() -> None:
+        # shared iterator: every change is picked up by exactly one worker
+        for change in pending:
+            failed, res = None, None
+            for action in change.actions:
+                res = await steps[action](change)
+                if not res or not res.get("success"):
+                    failed = action
+                    break
+            results.append((change, failed, res))
+            if on_result is not None:
+                ret = on_result(change, failed, res)
+                if inspect.isawaitable(ret):
+                    await ret
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
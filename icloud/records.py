@@ -0,0 +1,133 @@
+import datetime
+import time
+from typing import List, Optional, Tuple
+
+
+class Alias:
+    """A single Hide My Email address, built from a `/v2/hme/list` row"""
+
+    __slots__ = (
+        "hme",
+        "anonymous_id",
+        "label",
+        "note",
+        "is_active",
+        "create_timestamp",
+    )
+
+    def __init__(
+        self,
+        hme: str,
+        anonymous_id: Optional[str] = None,
+        label: str = "",
+        note: str = "",
+        is_active: bool = True,
+        create_timestamp: int = 0,
+    ):
+        self.hme = hme
+        self.anonymous_id = anonymous_id
+        self.label = label
+        self.note = note
+        self.is_active = is_active
+        # milliseconds since epoch, as returned by Apple
+        self.create_timestamp = create_timestamp
+
+    @classmethod
+    def from_json(cls, row: dict) -> "Alias":
+        return cls(
+            row["hme"],
+            row.get("anonymousId"),
+            row.get("label") or "",
+            row.get("note") or "",
+            bool(row.get("isActive", True)),
+            int(row.get("createTimestamp") or 0),
+        )
+
+    def as_json(self) -> dict:
+        """The `/v2/hme/list` row shape `from_json` reads"""
+        return {
+            "hme": self.hme,
+            "anonymousId": self.anonymous_id,
+            "label": self.label,
+            "note": self.note,
+            "isActive": self.is_active,
+            "createTimestamp": self.create_timestamp,
+        }
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Alias":
+        hme, anonymous_id, label, note, is_active, create_timestamp = row
+        return cls(hme, anonymous_id, label, note, bool(is_active), create_timestamp)
+
+    def as_row(self) -> Tuple[str, Optional[str], str, str, int, int]:
+        return (
+            self.hme,
+            self.anonymous_id,
+            self.label,
+            self.note,
+            int(self.is_active),
+            self.create_timestamp,
+        )
+
+    @property
+    def created(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.create_timestamp / 1000).replace(
+            microsecond=0
+        )
+
+    def __repr__(self) -> str:
+        return f"Alias({self.hme!r}, label={self.label!r}, is_active={self.is_active})"
+
+
+def parse_aliases(res: Optional[dict]) -> Optional[List[Alias]]:
+    """Builds alias records from a `list_email` response in one pass, None on error"""
+    try:
+        return [Alias.from_json(row) for row in res["result"]["hmeEmails"]]
+    except (KeyError, TypeError):
+        return None
+
+
+def account_identity(res: Optional[dict], dsid: Optional[str] = None) -> Optional[str]:
+    """Who a `list_email` response belongs to, see `same_account`.
+
+    The DSID when the cookies carry it, otherwise the addresses the account
+    forwards to.
+    """
+    if dsid:
+        return f"dsid:{dsid}"
+    try:
+        emails = res["result"]["forwardToEmails"]
+    except (KeyError, TypeError):
+        return None
+    forward = ",".join(sorted(email.lower() for email in emails))
+    return f"forward:{forward}" if forward else None
+
+
+def same_account(stored: Optional[str], identity: Optional[str]) -> bool:
+    """Whether two `account_identity` values can be the same Apple ID.
+
+    Forwarding lists change as the user edits them, they only tell accounts
+    apart when they share no address at all. Identities of different kinds,
+    or a missing one, are given the benefit of the doubt.
+    """
+    if stored is None or identity is None:
+        return True
+    stored_kind, _, stored_value = stored.partition(":")
+    kind, _, value = identity.partition(":")
+    if stored_kind != kind:
+        return True
+    if kind == "forward":
+        return bool(set(stored_value.split(",")) & set(value.split(",")))
+    return stored_value == value
+
+
+def reserved_alias(
+    email: str, res: Optional[dict], label: str = "", note: str = ""
+) -> Alias:
+    """The alias a `reserve_email` response describes, built locally if it has no row"""
+    row = (res or {}).get("result", {}).get("hme")
+    if isinstance(row, dict):
+        return Alias.from_json(row)
+    return Alias(
+        email, label=label, note=note, create_timestamp=int(time.time() * 1000)
+    )
@@ -0,0 +1,88 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from .inventory import Inventory
+from .records import Alias
+
+
+class Reservoir:
+    def __init__(
+        self,
+        inventory: Inventory,
+        refill: Callable[[], Awaitable[Optional[Alias]]],
+        low: int = 5,
+        high: int = 20,
+        backoff: float = 60.0,
+        max_backoff: float = 1800.0,
+    ):
+        """Pool of reserved but not yet handed out aliases, kept in the inventory.
+
+        `take` is a local pop. Once the pool drops to `low`, a background task
+        reserves aliases one at a time until it is back at `high`. A failed
+        reservation (usually Apple's rolling quota) pauses refilling for a delay
+        that doubles up to `max_backoff`.
+
+        Args:
+            inventory (Inventory)   Store the pool persists in
+            refill (callable)       Coroutine reserving one alias, None on failure
+            low (int)               Refill once the pool is this small
+            high (int)              Stop refilling at this size
+            backoff (float)         Seconds to wait after the first failed refill
+            max_backoff (float)     Upper bound of that wait
+        """
+        self.inventory = inventory
+        self._refill = refill
+        self.low = low
+        self.high = max(low, high)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._task: Optional[asyncio.Future] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def size(self) -> int:
+        return self.inventory.pool_size()
+
+    def take(self) -> Optional[Alias]:
+        alias = self.inventory.pool_pop()
+        if self._wake is not None and self.size <= self.low:
+            self._wake.set()
+        return alias
+
+    async def fill(self) -> int:
+        """Reserves aliases until the pool is at `high` or a reservation fails"""
+        added = 0
+        while self.size < self.high:
+            alias = await self._refill()
+            if alias is None:
+                break
+            self.inventory.pool_add(alias)
+            added += 1
+        return added
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = self._wake = None
+
+    async def _run(self) -> None:
+        delay = self.backoff
+        while True:
+            await self.fill()
+            if self.size < self.high:
+                await asyncio.sleep(delay)
+                delay = min(self.max_backoff, delay * 2)
+                continue
+            delay = self.backoff
+            self._wake.clear()
+            if self.size > self.low:
+                await self._wake.wait()
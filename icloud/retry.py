@@ -0,0 +1,105 @@
+import random
+from typing import Dict, Optional
+
+from .ratelimit import is_quota_exhausted, is_throttled
+
+RETRYABLE_OUTCOMES = (
+    "timeout",
+    "throttled",
+    "ClientConnectionError",
+    "ClientConnectorError",
+    "ClientOSError",
+    "ServerDisconnectedError",
+    "ServerTimeoutError",
+    "ConnectionResetError",
+)
+# raised before the request reached iCloud, safe to repeat for any call
+UNSENT_OUTCOMES = ("ClientConnectorError",)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 10.0,
+        budget: float = 30.0,
+        idempotent: bool = True,
+    ):
+        """How an endpoint call is retried.
+
+        Delays grow exponentially from `backoff` up to `max_backoff` with full
+        jitter. No attempt is started, and no attempt may run, past `budget`
+        seconds after the first one.
+
+        Args:
+            attempts (int)          Tries in total, 1 disables retrying
+            backoff (float)         Base delay before the first retry
+            max_backoff (float)     Upper bound of a single delay
+            connect_timeout (float) Seconds to establish a connection
+            read_timeout (float)    Seconds to wait for each chunk of the response
+            budget (float)          Seconds for all attempts and delays together
+            idempotent (bool)       False when a repeated call may be applied twice, only failures that never reached iCloud are retried then
+        """
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.budget = budget
+        self.idempotent = idempotent
+
+    def delay(self, attempt: int) -> float:
+        """Delay before retry number `attempt` (0 based)"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+# lost reservations waste a generated alias and the list payload can be large,
+# a reserve or delete that may have been applied is refused when sent again
+DEFAULT_RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    "generate": RetryPolicy(attempts=3),
+    "reserve": RetryPolicy(attempts=5, budget=60.0, idempotent=False),
+    "list": RetryPolicy(attempts=3, read_timeout=30.0, budget=90.0),
+    "delete": RetryPolicy(attempts=3, idempotent=False),
+    "deactivate": RetryPolicy(attempts=3),
+    "reactivate": RetryPolicy(attempts=3),
+    "updateMetaData": RetryPolicy(attempts=3),
+}
+
+
+def is_retryable(
+    outcome: str,
+    status: Optional[int],
+    res: Optional[dict],
+    idempotent: bool = True,
+) -> bool:
+    """Timeouts, dropped connections, 5xx and throttling are worth another try.
+
+    Any other answer from iCloud, a quota refusal above all, comes back the
+    same on a retry. A call that is not idempotent is only retried when it
+    never reached iCloud or was turned away by throttling.
+    """
+    if is_quota_exhausted(res):
+        return False
+    if not idempotent:
+        return outcome in UNSENT_OUTCOMES or is_throttled(status, res)
+    if outcome in RETRYABLE_OUTCOMES:
+        return True
+    if status is not None and status >= 500:
+        return True
+    return is_throttled(status, res)
+
+
+def is_ambiguous(outcome: str, status: Optional[int], res: Optional[dict]) -> bool:
+    """Whether a failed call may still have been applied by iCloud.
+
+    True when the request was sent but no answer came back, or the answer
+    was a 5xx other than throttling.
+    """
+    if outcome in UNSENT_OUTCOMES or outcome == "cancelled":
+        return False
+    if is_throttled(status, res):
+        return False
+    return status is None or status >= 500
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from typing import IO, Callable, Dict, List, Optional, Type
+
+from .records import Alias
+
+FIELDS = ("hme", "label", "note", "created", "account")
+
+
+class Sink:
+    """Buffered writer of reserved aliases.
+
+    Records are written in batches of `flush_every`, or sooner when `flush_interval`
+    seconds have passed since the last flush, so consumers can pick aliases up
+    while a run is still going. `autoflush` keeps that interval while no record
+    arrives, e.g. when a run waits out the quota.
+    """
+
+    def __init__(
+        self,
+        stream: IO[str],
+        flush_every: int = 10,
+        flush_interval: float = 1.0,
+        on_flush: Optional[Callable[[], None]] = None,
+        close_stream: bool = True,
+    ):
+        self.stream = stream
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.close_stream = close_stream
+        self.written = 0
+        self._buffer: List[str] = []
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self) -> "Sink":
+        return self
+
+    def __exit__(self, exc_t, exc_v, exc_tb) -> None:
+        self.close()
+
+    def header(self) -> Optional[str]:
+        return None
+
+    def format(self, record: Dict[str, str]) -> str:
+        raise NotImplementedError
+
+    def write(self, alias: Alias, account: str = "") -> None:
+        self._buffer.append(
+            self.format(
+                {
+                    "hme": alias.hme,
+                    "label": alias.label,
+                    "note": alias.note,
+                    "created": alias.created.isoformat()
+                    if alias.create_timestamp
+                    else "",
+                    "account": account,
+                }
+            )
+        )
+        self.written += 1
+        if (
+            len(self._buffer) >= self.flush_every
+            or time.monotonic() - self._flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        self.stream.write("".join(self._buffer))
+        self._buffer = []
+        self.stream.flush()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    async def autoflush(self) -> None:
+        """Flushes records older than `flush_interval` until cancelled"""
+        # cli.py imports this module for SINKS, keep asyncio off its startup path
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class TextSink(Sink):
+    def format(self, record: Dict[str, str]) -> str:
+        return record["hme"] + os.linesep
+
+
+class JsonlSink(Sink):
+    def format(self, record: Dict[str, str]) -> str:
+        return json.dumps(record) + "\n"
+
+
+class CsvSink(Sink):
+    def header(self) -> Optional[str]:
+        return self.format(dict(zip(FIELDS, FIELDS)))
+
+    def format(self, record: Dict[str, str]) -> str:
+        line = io.StringIO()
+        csv.writer(line).writerow(record[field] for field in FIELDS)
+        return line.getvalue()
+
+
+SINKS: Dict[str, Type[Sink]] = {
+    "text": TextSink,
+    "jsonl": JsonlSink,
+    "csv": CsvSink,
+}
+
+
+def open_sink(fmt: str, path: str, **kwargs) -> Sink:
+    """Opens a sink appending to `path`, or streaming to stdout when `path` is "-" """
+    cls = SINKS[fmt]
+    if path == "-":
+        sink = cls(sys.stdout, close_stream=False, **kwargs)
+        new = True
+    else:
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        sink = cls(open(path, "a", encoding="utf-8", newline=""), **kwargs)
+    header = sink.header()
+    if new and header:
+        sink.stream.write(header)
+    return sink
@@ -1,40 +1,229 @@
 import asyncio
-import datetime
 import os
-from typing import List, Optional, Awaitable, Callable
-import re
-from rich.text import Text
-from rich.prompt import IntPrompt
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Set,
+    Tuple,
+)
 from rich.console import Console
-from rich.table import Table
-from rich.box import MINIMAL_HEAVY_HEAD
-from icloud import HideMyEmail
+from icloud import HideMyEmail, Alias, AnonymousIdIndex, GenerationPipeline, Metrics
+from icloud import codec, reconcile
+from icloud.connection import ConnectionSettings
+from icloud.cookies import BrowserCookies, CookieError, FileCookies, cookie_dsid
+from icloud.inventory import Inventory
+from icloud.ratelimit import AdaptiveRateLimiter
+from icloud.journal import GenerationJournal, JournalState
+from icloud.quota import (
+    WINDOW_QUOTA,
+    WINDOW_SECONDS,
+    AccountQuota,
+    account_quota,
+    allocate,
+    allocate_over_time,
+    finish_eta,
+    window_opens,
+)
+from icloud.reconcile import Change, Plan
+from icloud.records import (
+    account_identity,
+    parse_aliases,
+    reserved_alias,
+    same_account,
+)
+from icloud.reservoir import Reservoir
+from icloud.sinks import SINKS, Sink, open_sink
+from settings import (
+    BASE_URL_ENVVAR,
+    COOKIE_BROWSER_ENVVAR,
+    COOKIE_ENVVAR,
+    DNS_TTL_ENVVAR,
+    INDEX_CACHE_ENVVAR,
+    INDEX_TTL_ENVVAR,
+    INVENTORY_ENVVAR,
+    JOURNAL_ENVVAR,
+    JSON_ENVVAR,
+    KEEPALIVE_ENVVAR,
+    LOOP_ENVVAR,
+    MAX_BULK_TASKS,
+    MAX_CONCURRENT_TASKS,
+    MAX_FAILED_ATTEMPTS,
+    POOL_HIGH,
+    POOL_LABEL,
+    POOL_LOW,
+    WINDOW_QUOTA_ENVVAR,
+    WINDOW_SECONDS_ENVVAR,
+)
 
+# process-wide, so every account of a run reports into one place
+METRICS = Metrics()
 
-MAX_CONCURRENT_TASKS = 5
-COOKIE_ENVVAR = "HME_COOKIE_ENVVAR"
+
+def _use(select: Callable[[str], str], envvar: str, fallback: str) -> str:
+    try:
+        return select(os.getenv(envvar, "auto"))
+    except ImportError as e:
+        Console(stderr=True).log(
+            f"[bold yellow][WARN][/] {envvar}: {e}, using {fallback} instead"
+        )
+        return select(fallback)
+
+
+# picked once at startup, falls back to the stdlib when not installed
+JSON_BACKEND = _use(codec.use_json, JSON_ENVVAR, "json")
+
+
+def select_loop() -> str:
+    """Installs the HME_LOOP event loop policy, returns the loop in use.
+
+    Called by entry points right before they start their loop, so importing
+    this module leaves the policy of a host application alone.
+    """
+    return _use(codec.use_loop, LOOP_ENVVAR, "asyncio")
+
+
+def account_name(path: str) -> str:
+    """The cookie file's name without its extension"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def account_names(files: List[str]) -> List[str]:
+    """Unique account names for cookie files, one each.
+
+    Files whose names clash, e.g. a/cookie.txt and b/cookie.txt, are named by
+    their path relative to the working directory instead.
+    """
+    names = [account_name(f) for f in files]
+    clashes = {name for name in names if names.count(name) > 1}
+    return [
+        os.path.splitext(os.path.relpath(f))[0].replace(os.sep, "/")
+        if name in clashes
+        else name
+        for f, name in zip(files, names)
+    ]
+
+
+def cookie_provider(path: str) -> FileCookies:
+    """The cookie file, re-extracted from HME_COOKIE_BROWSER when iCloud rejects it"""
+    browser = os.getenv(COOKIE_BROWSER_ENVVAR)
+    return FileCookies(path, fallback=BrowserCookies(browser) if browser else None)
 
 
 class RichHideMyEmail(HideMyEmail):
     _cookie_file = os.getenv(COOKIE_ENVVAR, "cookie.txt")
 
-    def __init__(self, label: Optional[str], notes: Optional[str]):
-        super().__init__(label=label, notes=notes)
-        self.console = Console()
-        self.table = Table(
-            box=MINIMAL_HEAVY_HEAD,
-            padding=(0, 0, 1, 0),  # top, right, bottom, and left borders
+    def __init__(
+        self,
+        label: Optional[str],
+        notes: Optional[str],
+        cookie_file: Optional[str] = None,
+        concurrency: int = MAX_CONCURRENT_TASKS,
+        account: Optional[str] = None,
+    ):
+        if cookie_file:
+            self._cookie_file = cookie_file
+        # name the account is tagged with when several are used at once
+        self.account = account or account_name(self._cookie_file)
+        super().__init__(
+            label=label,
+            notes=notes,
+            base_url=os.getenv(BASE_URL_ENVVAR),
+            metrics=METRICS,
+            cookie_provider=cookie_provider(self._cookie_file),
+            connection=ConnectionSettings.for_concurrency(
+                concurrency,
+                keepalive_timeout=float(os.getenv(KEEPALIVE_ENVVAR, "30")),
+                dns_cache_ttl=int(os.getenv(DNS_TTL_ENVVAR, "300")),
+            ),
         )
+        self._console: Optional[Console] = None
 
-        if os.path.exists(self._cookie_file) and os.path.getsize(self._cookie_file) > 1:
-            # load in a cookie string from file
-            with open(self._cookie_file, "r") as f:
-                self.cookies = [line for line in f if not line.startswith("//")][0]
-        else:
+        if not self.cookies:
             self.console.log(
-                '[bold yellow][WARN][/] No "cookie.txt" file found OR file maybe empty! Generation will not work due to unauthorized access'
+                f'[bold yellow][WARN][/] No "{self._cookie_file}" file found OR file maybe empty! Generation will not work due to unauthorized access'
             )
-            exit(1)
+            raise CookieError(self._cookie_file)
+
+        self.inventory = Inventory(
+            os.getenv(INVENTORY_ENVVAR, "inventory.db"), self.account
+        )
+        self._anonymous_ids = self._new_index()
+        self.reservoir = Reservoir(self.inventory, self._pool_one, POOL_LOW, POOL_HIGH)
+        self.window_quota = int(os.getenv(WINDOW_QUOTA_ENVVAR, WINDOW_QUOTA))
+        self.window_seconds = float(os.getenv(WINDOW_SECONDS_ENVVAR, WINDOW_SECONDS))
+        self.journal: Optional[GenerationJournal] = None
+        self.sink: Optional[Sink] = None
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb):
+        await super().__aexit__(exc_t, exc_v, exc_tb)
+        self.inventory.close()
+
+    @property
+    def console(self) -> Console:
+        # built on first use, most runs replace or never need it
+        if self._console is None:
+            self._console = Console()
+        return self._console
+
+    @console.setter
+    def console(self, console: Console):
+        self._console = console
+
+    async def _sync_inventory(self) -> Tuple[Optional[List[Alias]], Optional[dict]]:
+        """Downloads the alias list and syncs the local inventory with it.
+
+        Returns the aliases, or None and the failed response.
+        """
+        res = await self.list_email()
+        aliases = parse_aliases(res)
+        if aliases is None:
+            return None, res
+        self._sync_snapshot(aliases, res)
+        return aliases, None
+
+    def _sync_snapshot(self, aliases: List[Alias], res: dict) -> None:
+        identity = account_identity(res, cookie_dsid(self.cookies))
+        if not same_account(self.inventory.identity, identity):
+            dropped = self.inventory.reset()
+            self.console.log(
+                f'[bold yellow][WARN][/] "{self._cookie_file}" now belongs to another '
+                "Apple ID, its inventory, reservoir and reservation history were reset"
+            )
+            if dropped:
+                self.console.log(
+                    f"[bold yellow][WARN][/] {len(dropped)} pooled email(s) of the "
+                    f"previous Apple ID were dropped: {', '.join(dropped)}"
+                )
+        self.inventory.sync(aliases, identity)
+
+    @property
+    def _inventory_stale(self) -> bool:
+        """Never synced, or the cookie file changed since, possibly to another Apple ID"""
+        synced_at = self.inventory.synced_at
+        if synced_at is None:
+            return True
+        try:
+            return os.path.getmtime(self._cookie_file) > synced_at
+        except OSError:
+            return False
+
+    def _new_index(self) -> AnonymousIdIndex:
+        return AnonymousIdIndex(
+            self.list_email,
+            on_snapshot=self._sync_snapshot,
+            cache_file=os.getenv(INDEX_CACHE_ENVVAR),
+            ttl=float(os.getenv(INDEX_TTL_ENVVAR, "300")),
+            key=self.cookies,
+        )
 
     async def _log_email_error(
         self,
@@ -57,7 +246,9 @@ class RichHideMyEmail(HideMyEmail):
             f"Reason: {err_msg}"
         )
 
-    async def _generate_one(self) -> Optional[str]:
+    async def _generate_one(
+        self, label: Optional[str] = None, notes: Optional[str] = None
+    ) -> Optional[Alias]:
         # First, generate an email
         gen_res = await self.generate_email()
         if not gen_res:
@@ -66,31 +257,248 @@ class RichHideMyEmail(HideMyEmail):
             email = gen_res["result"]["hme"]
             self.console.log(f'[50%] "{email}" - Successfully generated')
             # Then, reserve it
-            reserve_res = await self.reserve_email(email)
-            if not reserve_res:
+            reserve_res = await self.reserve_email(email, label, notes)
+            if not reserve_res or not reserve_res.get("success"):
                 await self._log_email_error(
-                    reserve_res, action_name="get", target="reserve"
+                    reserve_res, email, action_name="get", target="reserve"
                 )
+                return None
             self.console.log(f'[100%] "{email}" - Successfully reserved')
-            return email
-        except KeyError:
+            alias = self._reserved_alias(email, reserve_res)
+            self.inventory.upsert(alias)
+            self.inventory.record_reservation(alias.hme)
+            if alias.anonymous_id:
+                self._anonymous_ids.add(alias.hme, alias.anonymous_id)
+            return alias
+        except (KeyError, TypeError):
+            await self._log_email_error(gen_res, action_name="get", target="generate")
+            self.console.log(
+                "[bold yellow][WARN][/] Make sure"
+                "[yellow][italic] cookie.txt[/][/] is up to date"
+            )
+
+    async def _pool_one(self) -> Optional[Alias]:
+        return await self._generate_one(POOL_LABEL, "")
+
+    async def checkout(self, label: str, notes: Optional[str]) -> Optional[Alias]:
+        """Hands out a pooled alias stamped with `label` and `notes`.
+
+        Pooled aliases that no longer exist in the account are dropped and the
+        next one is tried. Falls back to generating one when the reservoir is
+        empty.
+        """
+        if self._inventory_stale:
+            # the pool may hold aliases of the Apple ID the cookie belonged to before
+            await self._sync_inventory()
+        while True:
+            alias = self.reservoir.take()
+            if alias is None:
+                self.console.log(
+                    "[bold yellow][WARN][/] Reservoir is empty, generating a new email"
+                )
+                return await self._generate_one(label, notes)
+            if not alias.anonymous_id:
+                alias.anonymous_id = await self._get_anonymousid(alias.hme)
+            if alias.anonymous_id:
+                res = await self.update_metadata(alias.anonymous_id, label, notes)
+                if res and res.get("success"):
+                    alias.label, alias.note = label, notes or ""
+                    self.inventory.upsert(alias)
+                    return alias
+                await self._log_email_error(res, alias.hme, action_name="label")
+            if await self._exists(alias.hme) is not False:
+                # still reserved, keep it for the next checkout
+                self.inventory.pool_add(alias)
+                return None
+            self.inventory.remove(alias.hme)
+            self.console.log(
+                f"[bold yellow][WARN][/] {alias.hme} no longer exists, "
+                "dropped it from the reservoir"
+            )
+
+    async def _exists(self, hme: str) -> Optional[bool]:
+        """Whether `hme` is in a fresh list of the account, None when that list failed"""
+        index = await self._anonymous_ids.refresh()
+        if self._anonymous_ids.error:
+            return None
+        return hme in index
+
+    async def _log_generated(self, email: str) -> None:
+        if self.journal:
+            self.journal.generated(email)
+        self.console.log(f'[50%] "{email}" - Successfully generated')
+
+    async def _log_reserved(self, email: str, res: dict) -> None:
+        if self.journal:
+            self.journal.reserved(email)
+        self.console.log(f'[100%] "{email}" - Successfully reserved')
+        alias = self._reserved_alias(email, res)
+        self.inventory.upsert(alias)
+        self.inventory.record_reservation(alias.hme)
+        if alias.anonymous_id:
+            self._anonymous_ids.add(alias.hme, alias.anonymous_id)
+        if self.sink:
+            self.sink.write(alias, self.account)
+
+    def _reserved_alias(self, email: str, res: Optional[dict]) -> Alias:
+        return reserved_alias(email, res, self.label or "", self.notes or "")
+
+    async def _log_failed(self, stage: str, res: Optional[dict], email: str) -> None:
+        if self.journal and email:
+            self.journal.failed(email)
+        await self._log_email_error(res, email, action_name="get", target=stage)
+
+    async def _generate(
+        self,
+        count: int,
+        concurrency: int,
+        reserve_concurrency: int,
+        candidates: Iterable[str] = (),
+    ) -> List[str]:
+        pipeline = GenerationPipeline(
+            self,
+            count,
+            candidates=candidates,
+            generate_concurrency=concurrency,
+            reserve_concurrency=reserve_concurrency,
+            max_failed_attempts=MAX_FAILED_ATTEMPTS,
+            on_generated=self._log_generated,
+            on_reserved=self._log_reserved,
+            on_failed=self._log_failed,
+        )
+        emails = await pipeline.run()
+        if pipeline.unreserved:
+            self.console.log(
+                f"[bold yellow][WARN][/] {len(pipeline.unreserved)} generated email(s) "
+                f"could not be reserved: {', '.join(pipeline.unreserved)}"
+            )
+        if len(emails) < count and pipeline.quota_exhausted:
+            self.console.log(
+                "[bold yellow][WARN][/] iCloud refused for quota, "
+                f"stopped after {len(emails)} of {count} email(s)"
+            )
+        elif len(emails) < count and pipeline.stopped:
             self.console.log(
                 "[bold yellow][WARN][/] Make sure"
                 "[yellow][italic] cookie.txt[/][/] is up to date"
             )
+        return emails
+
+    async def quota(self) -> Optional[AccountQuota]:
+        aliases, res = await self._sync_inventory()
+        quota = account_quota(
+            aliases, window_quota=self.window_quota, window_seconds=self.window_seconds
+        )
+        if quota is None:
+            await self._log_email_error(
+                res, self.account, action_name="get", target="quota"
+            )
+            return None
+        # deleted aliases still count against the window, the inventory remembers them
+        recent = self.inventory.reservation_times(time.time() - self.window_seconds)
+        return quota._replace(recent=max(quota.recent, len(recent)))
 
-    async def _generate(self, num: int):
-        tasks = []
-        for _ in range(num):
-            task = asyncio.create_task(self._generate_one())
-            tasks.append(task)
-        return filter(lambda e: e is not None, await asyncio.gather(*tasks))
+    async def _generate_scheduled(
+        self,
+        count: int,
+        concurrency: int,
+        reserve_concurrency: int,
+        candidates: Iterable[str] = (),
+    ) -> List[str]:
+        """Generates `count` emails, sleeping whenever Apple's rolling window is used up.
 
-    async def generate(self, count: Optional[int]) -> List[str]:
+        Reservation times are kept in the inventory, so the window carries over
+        between runs and requests are only sent once a slot is free. Stops early
+        at the lifetime cap.
+        """
+        emails: List[str] = []
+        quota = await self.quota()
+        if quota is None:
+            return emails
+        cap_left = quota.lifetime_remaining
+        while len(emails) < count:
+            if cap_left <= 0:
+                self.console.log(
+                    f"[bold yellow][WARN][/] {self.account or 'Account'} reached the "
+                    f"lifetime cap of {quota.lifetime_cap} email(s)"
+                )
+                break
+            now = time.time()
+            times = self.inventory.reservation_times(now - self.window_seconds)
+            opens = window_opens(times, now, self.window_quota, self.window_seconds)
+            if opens > now:
+                left = min(count - len(emails), cap_left)
+                eta = finish_eta(
+                    left, times, now, self.window_quota, self.window_seconds
+                )
+                self.console.log(
+                    f"{self.account}: quota window is full, next slot at {time.strftime('%X', time.localtime(opens))}; "
+                    f"{left} email(s) left, ETA {time.strftime('%x %X', time.localtime(eta))}"
+                )
+                await asyncio.sleep(opens - now)
+                continue
+            batch = min(
+                count - len(emails), cap_left, max(1, self.window_quota - len(times))
+            )
+            reserved = await self._generate(
+                batch,
+                min(concurrency, batch),
+                min(reserve_concurrency, batch),
+                candidates,
+            )
+            candidates = ()
+            emails += reserved
+            cap_left -= len(reserved)
+            if len(reserved) < batch:
+                # refused although the window looked free: aliases were made
+                # elsewhere since the last sync, or Apple's limits are tighter
+                quota = await self.quota()
+                if quota is None:
+                    break
+                cap_left = quota.lifetime_remaining
+                times = self.inventory.reservation_times(now - self.window_seconds)
+                if (
+                    window_opens(times, now, self.window_quota, self.window_seconds)
+                    <= now
+                ):
+                    wait = self.window_seconds - (now - min(times, default=now))
+                    self.console.log(
+                        f"[bold yellow][WARN][/] Apple refused a reservation the window "
+                        f"should allow, waiting {wait / 60:.0f} min"
+                    )
+                    await asyncio.sleep(wait)
+        return emails
+
+    async def generate(
+        self,
+        count: Optional[int],
+        concurrency: int = MAX_CONCURRENT_TASKS,
+        reserve_concurrency: int = MAX_CONCURRENT_TASKS,
+        resume: bool = False,
+        output: str = "emails.txt",
+        fmt: str = "text",
+        wait: bool = False,
+    ) -> List[str]:
+        journal_file = os.getenv(JOURNAL_ENVVAR, "journal.jsonl")
+        state = GenerationJournal.load(journal_file) if resume else JournalState()
         try:
-            emails = []
             self.console.rule()
-            if count is None:
+            if resume:
+                if state.run is None:
+                    self.console.log(
+                        f'[bold yellow][WARN][/] Nothing to resume in "{journal_file}"'
+                    )
+                    return []
+                count = state.remaining
+                self.label, self.notes = state.label, state.notes
+                self.console.log(
+                    f"Resuming: {len(state.reserved)}/{state.target} email(s) reserved, "
+                    f"{len(state.pending)} generated email(s) left to reserve"
+                )
+            elif count is None:
+                from rich.prompt import IntPrompt
+                from rich.text import Text
+
                 s = IntPrompt.ask(
                     Text.assemble(("How many iCloud emails you want to generate?")),
                     console=self.console,
@@ -98,165 +506,562 @@ class RichHideMyEmail(HideMyEmail):
                 count = int(s)
             self.console.log(f"Generating {count} email(s)...")
             self.console.rule()
-            with self.console.status("[bold green]Generating iCloud email(s)..."):
-                while count > 0:
-                    batch = await self._generate(
-                        count if count < MAX_CONCURRENT_TASKS else MAX_CONCURRENT_TASKS
-                    )
-                    count -= MAX_CONCURRENT_TASKS
-                    emails += batch
+            # nested, a parenthesized multi-item with needs Python 3.9
+            with GenerationJournal(journal_file) as self.journal:
+                with open_sink(fmt, output, on_flush=self.journal.saved) as self.sink:
+                    if resume:
+                        self.journal.resume(state.run)
+                    else:
+                        self.journal.start(count, self.label, self.notes)
+                    # reserved by the interrupted run but never saved
+                    for email in state.unsaved:
+                        self.sink.write(self._reserved_alias(email, None), self.account)
+                    with self.console.status(
+                        "[bold green]Generating iCloud email(s)..."
+                    ):
+                        run = self._generate_scheduled if wait else self._generate
+                        flusher = asyncio.ensure_future(self.sink.autoflush())
+                        try:
+                            emails = await run(
+                                count, concurrency, reserve_concurrency, state.pending
+                            )
+                        finally:
+                            flusher.cancel()
+            emails = state.unsaved + emails
             if len(emails) > 0:
-                with open("emails.txt", "a+") as f:
-                    f.write(os.linesep.join(emails) + os.linesep)
                 self.console.rule()
+                if output != "-":
+                    self.console.log(
+                        f':star: Emails have been saved into the "{output}" file'
+                    )
                 self.console.log(
-                    ':star: Emails have been saved into the "emails.txt" file'
+                    f"[bold green]All done![/] Successfully generated [bold green]{len(emails)}[/] email(s)"
                 )
+            if self.limiter.throttled:
                 self.console.log(
-                    f"[bold green]All done![/] Successfully generated [bold green]{len(emails)}[/] email(s)"
+                    f"[bold yellow][WARN][/] Apple throttled {self.limiter.throttled} request(s), "
+                    f"request rate settled at {self.limiter.rate:.2f}/s"
                 )
             return emails
         except KeyboardInterrupt:
             return []
+        finally:
+            self.journal = self.sink = None
 
-    async def list(self, active: bool, search: str) -> None:
-        gen_res = await self.list_email()
-        if not gen_res:
-            await self._log_email_error(gen_res, action_name="get", target="list")
-        self.table.add_column("Label", no_wrap=True)
-        self.table.add_column("Notes")
-        self.table.add_column("Hide my email", no_wrap=True)
-        self.table.add_column("Created Date Time")
-        self.table.add_column("IsActive")
-        try:
-            for row in gen_res["result"]["hmeEmails"]:
-                if search is not None and re.search(
-                    search, row["label"], flags=re.IGNORECASE
-                ):
-                    raw_time = datetime.datetime.fromtimestamp(
-                        row["createTimestamp"] / 1000
-                    )
-                    self.table.add_row(
-                        row["label"],
-                        row["note"],
-                        row["hme"],
-                        str(raw_time.replace(microsecond=0)),
-                        str(row["isActive"]),
-                    )
-                if row["isActive"] == active and search is None:
-                    raw_time = datetime.datetime.fromtimestamp(
-                        row["createTimestamp"] / 1000
-                    )
-                    self.table.add_row(
-                        row["label"],
-                        row["note"],
-                        row["hme"],
-                        str(raw_time.replace(microsecond=0)),
-                        str(row["isActive"]),
-                    )
-            self.console.print(self.table)
-        except KeyError:
-            self.console.log(
-                "[bold yellow][WARN][/] Make sure"
-                "[yellow][italic] cookie.txt[/][/] is up to date"
-            )
+    async def list(
+        self,
+        active: bool,
+        search: Optional[str],
+        refresh: bool = False,
+        fmt: str = "table",
+        **filters,
+    ) -> None:
+        """Prints the inventory, filtered by `Inventory.iter_search` keywords.
+
+        jsonl and csv rows are streamed as they are read, only the table
+        needs every row in memory.
+        """
+        if refresh or self._inventory_stale:
+            aliases, gen_res = await self._sync_inventory()
+            if aliases is None:
+                await self._log_email_error(gen_res, action_name="get", target="list")
+                self.console.log(
+                    "[bold yellow][WARN][/] Make sure"
+                    "[yellow][italic] cookie.txt[/][/] is up to date"
+                )
+                return
+        # a text search matches active and inactive emails alike
+        if search is not None or filters.get("note") or filters.get("hme"):
+            active = None
+        aliases = self.inventory.iter_search(active, label=search, **filters)
+        # rich.table is only needed here, keep it off the startup path
+        from output import alias_table, write_aliases
+
+        if fmt == "table":
+            self.console.print(alias_table(aliases))
+        else:
+            write_aliases(aliases, fmt)
 
     async def _get_anonymousid(self, hme: str) -> Optional[str]:
         # anonymousid needed as payload for delete, deactivate, reactivate endpoints
-        gen_res = await self.list_email()
-        if not gen_res:
+        anonymous_id = await self._anonymous_ids.get(hme)
+        if self._anonymous_ids.error:
             await self._log_email_error(
-                gen_res, hme, action_name="get", target="anonymousId"
+                self._anonymous_ids.error, hme, action_name="get", target="anonymousId"
             )
-        try:
-            for row in gen_res["result"]["hmeEmails"]:
-                if row.get("hme") == hme:
-                    return row.get("anonymousId")
+            return None
+        if anonymous_id is None:
             self.console.log(
                 f"[bold red][ERR][/] - No [italic][green]anonymousId[/][/] "
                 f"found for [italic][green]{hme}[/][/], "
                 f"make sure email exist!"
             )
-            return None
-        except KeyError as e:
-            self.console.log(f"[bold red][ERR][/] - KeyError: {str(e)}.")
-        return None
+        return anonymous_id
 
     async def _handle_email_action(
         self,
         hme: str,
         action_func: Callable[[str], Awaitable[Optional[dict]]],
         action_name: str,
-    ) -> None:
+    ) -> bool:
         """Generic function"""
         hme = hme.strip()
         anonymous_id = await self._get_anonymousid(hme)
         if anonymous_id is None:
-            return
+            return False
         gen_res = await action_func(anonymous_id)
         if not gen_res or not gen_res.get("success"):
             await self._log_email_error(gen_res, hme, action_name)
-            return
+            return False
         self.console.log(
             f"Email: [italic][bright_blue]{hme}[/][/] was successfully {action_name}"
         )
+        return True
+
+    def _unique(self, hmes: Iterable[str], skipped: Counter) -> Iterator[str]:
+        """Lazily yields stripped emails, skipping blank and duplicate lines"""
+        seen: Set[str] = set()
+        for hme in hmes:
+            hme = hme.strip()
+            if not hme:
+                skipped["blank"] += 1
+            elif hme in seen:
+                skipped["duplicate"] += 1
+            else:
+                seen.add(hme)
+                yield hme
 
-    async def _delete_one(self, hme: str) -> None:
-        await self._handle_email_action(hme, self.delete_email, "delete")
+    async def _bulk(
+        self,
+        hmes: Iterable[str],
+        action_one: Callable[[str], Awaitable[bool]],
+        action_name: str,
+        concurrency: int,
+    ) -> Counter:
+        """Streams `hmes` through at most `concurrency` concurrent actions"""
+        self._anonymous_ids = self._new_index()
+        results: Counter = Counter()
+        emails = self._unique(hmes, results)
+        with self.console.status(
+            f"[bold green]{action_name.capitalize()}..."
+        ) as status:
 
-    async def delete(self, hmes: List[str]) -> None:
-        tasks = [asyncio.create_task(self._delete_one(hme)) for hme in hmes]
-        await asyncio.gather(*tasks)
+            async def worker() -> None:
+                # shared iterator: input is read only as fast as it is processed
+                for hme in emails:
+                    results["success" if await action_one(hme) else "failed"] += 1
+                    status.update(
+                        f"[bold green]{action_name.capitalize()}...[/] "
+                        f"{results['success']} done, {results['failed']} failed"
+                    )
 
-    async def _deactivate_one(self, hme: str) -> None:
-        await self._handle_email_action(
-            hme, self.deactivate_email, "disable for forwarding"
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        self.console.rule()
+        self.console.log(
+            f"[bold green]All done![/] {action_name.capitalize()}: "
+            f"[bold green]{results['success']}[/] succeeded, "
+            f"[bold red]{results['failed']}[/] failed, "
+            f"{results['duplicate']} duplicate and {results['blank']} blank line(s) skipped"
         )
+        return results
+
+    async def _delete_one(self, hme: str) -> bool:
+        if not await self._handle_email_action(hme, self.delete_email, "delete"):
+            return False
+        self._anonymous_ids.discard(hme.strip())
+        self.inventory.remove(hme.strip())
+        return True
 
-    async def deactivate(self, hmes: List[str]) -> None:
-        tasks = [asyncio.create_task(self._deactivate_one(hme)) for hme in hmes]
-        await asyncio.gather(*tasks)
+    async def delete(
+        self, hmes: Iterable[str], concurrency: int = MAX_BULK_TASKS
+    ) -> Counter:
+        return await self._bulk(hmes, self._delete_one, "delete", concurrency)
 
-    async def _reactivate_one(self, hme: str) -> None:
-        await self._handle_email_action(
+    async def _deactivate_one(self, hme: str) -> bool:
+        if not await self._handle_email_action(
+            hme, self.deactivate_email, "disable for forwarding"
+        ):
+            return False
+        self.inventory.set_active(hme.strip(), False)
+        return True
+
+    async def deactivate(
+        self, hmes: Iterable[str], concurrency: int = MAX_BULK_TASKS
+    ) -> Counter:
+        return await self._bulk(hmes, self._deactivate_one, "deactivate", concurrency)
+
+    async def _reactivate_one(self, hme: str) -> bool:
+        if not await self._handle_email_action(
             hme, self.reactivate_email, "enable for forwarding"
+        ):
+            return False
+        self.inventory.set_active(hme.strip(), True)
+        return True
+
+    async def reactivate(
+        self, hmes: Iterable[str], concurrency: int = MAX_BULK_TASKS
+    ) -> Counter:
+        return await self._bulk(hmes, self._reactivate_one, "reactivate", concurrency)
+
+    async def plan(self, path: str) -> Optional[Plan]:
+        """Diffs a desired-state file against a fresh alias list and logs the steps"""
+        try:
+            desired = reconcile.load_desired(path)
+        except (OSError, ValueError) as e:
+            self.console.log(f"[bold red][ERR][/] - Can't read [italic]{path}[/]: {e}")
+            return None
+        aliases, gen_res = await self._sync_inventory()
+        if aliases is None:
+            await self._log_email_error(gen_res, action_name="get", target="list")
+            return None
+        plan = reconcile.plan(desired, aliases)
+        for change in plan.changes:
+            self.console.log(
+                f"[italic][bright_blue]{change.hme}[/][/]: {', '.join(change.actions)}"
+            )
+        for hme in plan.missing:
+            self.console.log(
+                f"[bold yellow][WARN][/] [italic]{hme}[/] is not in the account, "
+                "it can't be created by address"
+            )
+        counts = plan.counts()
+        self.console.rule()
+        self.console.log(
+            f"Plan: {len(plan.changes)} email(s) to change "
+            f"({', '.join(f'{n} {a}' for a, n in counts.items()) or 'nothing'}), "
+            f"{plan.unchanged} unchanged, {len(plan.missing)} missing"
         )
+        return plan
+
+    def _applied(self, change: Change) -> None:
+        if "delete" in change.actions:
+            self.inventory.remove(change.hme)
+            return
+        if "update" in change.actions:
+            self.inventory.set_metadata(change.hme, change.label, change.note)
+        if "deactivate" in change.actions or "reactivate" in change.actions:
+            self.inventory.set_active(change.hme, "reactivate" in change.actions)
 
-    async def reactivate(self, hmes: List[str]) -> None:
-        tasks = [asyncio.create_task(self._reactivate_one(hme)) for hme in hmes]
-        await asyncio.gather(*tasks)
+    async def apply(self, path: str, concurrency: int = MAX_BULK_TASKS) -> Counter:
+        """Brings the account in line with a desired-state file"""
+        plan = await self.plan(path)
+        if plan is None:
+            return Counter()
+        return await self._apply_plan(plan, concurrency)
+
+    async def _apply_plan(
+        self,
+        plan: Plan,
+        concurrency: int,
+        action_name: str = "apply",
+        failed_file: Optional[str] = None,
+    ) -> Counter:
+        """Runs a plan with progress, writing failed emails to `failed_file` as they happen"""
+        results: Counter = Counter()
+        if not plan.changes:
+            return results
+        failed_out = None
+        title = f"{action_name.capitalize()}ing..."
+        try:
+            with self.console.status(f"[bold green]{title}") as status:
+
+                async def on_result(
+                    change: Change, failed: Optional[str], res: Optional[dict]
+                ) -> None:
+                    nonlocal failed_out
+                    if failed is None:
+                        self._applied(change)
+                        results["success"] += 1
+                    else:
+                        await self._log_email_error(res, change.hme, failed)
+                        results["failed"] += 1
+                        if failed_file:
+                            if failed_out is None:
+                                failed_out = open(failed_file, "w", encoding="utf-8")
+                            failed_out.write(change.hme + "\n")
+                            failed_out.flush()
+                    status.update(
+                        f"[bold green]{title}[/] "
+                        f"{results['success']}/{len(plan.changes)} done, "
+                        f"{results['failed']} failed"
+                    )
+
+                await reconcile.apply(self, plan, concurrency, on_result)
+        finally:
+            if failed_out is not None:
+                failed_out.close()
+        self.console.rule()
+        self.console.log(
+            f"[bold green]All done![/] {action_name.capitalize()}: "
+            f"[bold green]{results['success']}[/] succeeded, "
+            f"[bold red]{results['failed']}[/] failed"
+        )
+        if failed_out is not None:
+            self.console.log(
+                f'Failed emails were written to "{failed_file}", '
+                f"retry them with [italic]--file {failed_file}[/]"
+            )
+        return results
+
+    async def relabel(
+        self,
+        label: Optional[str],
+        note: Optional[str],
+        filters: Dict[str, Any],
+        emails: Optional[Iterable[str]] = None,
+        concurrency: int = MAX_BULK_TASKS,
+        failed_file: Optional[str] = None,
+    ) -> Counter:
+        """Sets a new label and/or note on every alias the filters select.
+
+        Aliases are picked from one fresh list snapshot with `filters`, keywords
+        of `Inventory.iter_search`, narrowed to `emails` if given. Aliases that
+        already carry the new values cost no request.
+        """
+        aliases, gen_res = await self._sync_inventory()
+        if aliases is None:
+            await self._log_email_error(gen_res, action_name="get", target="list")
+            return Counter()
+        wanted = None if emails is None else set(self._unique(emails, Counter()))
+        desired = reconcile.DesiredState(
+            {
+                alias.hme: reconcile.DesiredAlias(alias.hme, None, label, note)
+                for alias in self.inventory.iter_search(**filters)
+                if wanted is None or alias.hme in wanted
+            }
+        )
+        plan = reconcile.plan(desired, aliases)
+        if wanted is not None and len(wanted) > len(desired.aliases):
+            self.console.log(
+                f"[bold yellow][WARN][/] {len(wanted) - len(desired.aliases)} listed "
+                f"email(s) are not in the account or don't match the filters"
+            )
+        self.console.log(
+            f"{len(desired.aliases)} email(s) selected, {len(plan.changes)} to relabel, "
+            f"{len(desired.aliases) - len(plan.changes)} already up to date"
+        )
+        return await self._apply_plan(plan, concurrency, "relabel", failed_file)
 
 
 async def generate(
-    count: Optional[int], label: Optional[str], notes: Optional[str]
+    count: Optional[int],
+    label: Optional[str],
+    notes: Optional[str],
+    concurrency: int = MAX_CONCURRENT_TASKS,
+    reserve_concurrency: int = MAX_CONCURRENT_TASKS,
+    resume: bool = False,
+    output: str = "emails.txt",
+    fmt: str = "text",
+    wait: bool = False,
 ) -> None:
-    async with RichHideMyEmail(label, notes) as hme:
-        await hme.generate(count)
+    async with RichHideMyEmail(
+        label, notes, concurrency=concurrency + reserve_concurrency
+    ) as hme:
+        if output == "-":
+            # keep stdout for the emails
+            hme.console = Console(stderr=True)
+        await hme.generate(
+            count, concurrency, reserve_concurrency, resume, output, fmt, wait
+        )
+
+
+def cookie_files(paths: Iterable[str]) -> List[str]:
+    """Expands directories into the cookie files they contain, each file once"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(".txt") and not name.startswith(".")
+            )
+        else:
+            files.append(path)
+    seen: Set[str] = set()
+    unique = []
+    for f in files:
+        if os.path.realpath(f) not in seen:
+            seen.add(os.path.realpath(f))
+            unique.append(f)
+    return unique
+
+
+async def generate_sharded(
+    count: int,
+    label: Optional[str],
+    notes: Optional[str],
+    cookies: Iterable[str],
+    concurrency: int = MAX_CONCURRENT_TASKS,
+    reserve_concurrency: int = MAX_CONCURRENT_TASKS,
+    output: str = "emails.csv",
+    fmt: str = "csv",
+    wait: bool = False,
+) -> None:
+    """Generates `count` emails spread across several accounts, one cookie file each.
+
+    With `wait`, accounts sleep through their rolling windows and the count is
+    split so that the last email is reserved as early as possible.
+    """
+    console = Console(stderr=output == "-")
+    async with AsyncExitStack() as stack:
+        accounts = []
+        files = cookie_files(cookies)
+        for f, name in zip(files, account_names(files)):
+            try:
+                hme = RichHideMyEmail(
+                    label,
+                    notes,
+                    cookie_file=f,
+                    concurrency=concurrency + reserve_concurrency,
+                    account=name,
+                )
+            except CookieError:
+                # the other accounts can still cover the count
+                continue
+            accounts.append(await stack.enter_async_context(hme))
+        if not accounts:
+            raise CookieError(", ".join(cookies))
+        quotas = await asyncio.gather(*(hme.quota() for hme in accounts))
+        if wait:
+            now = time.time()
+            shares = allocate_over_time(
+                count,
+                quotas,
+                [
+                    hme.inventory.reservation_times(now - hme.window_seconds)
+                    for hme in accounts
+                ],
+                now,
+                accounts[0].window_quota,
+                accounts[0].window_seconds,
+            )
+        else:
+            shares = allocate(count, quotas)
+        console.rule()
+        for hme, quota, share in zip(accounts, quotas, shares):
+            left = "unknown" if quota is None else quota.lifetime_remaining
+            now_left = (
+                "" if quota is None or wait else f"{quota.window_remaining} now, "
+            )
+            console.log(
+                f"[bold]{hme.account}[/]: {share} email(s), {now_left}{left} left in account"
+            )
+        if sum(shares) < count:
+            console.log(
+                f"[bold yellow][WARN][/] Accounts only have quota for {sum(shares)} "
+                f"of {count} email(s), {count - sum(shares)} short"
+                + ("" if wait else ", --wait waits for the rolling windows")
+            )
+        console.rule()
+        # one sink for all accounts, every row is tagged with its account
+        sink = stack.enter_context(open_sink(fmt, output))
+        for hme in accounts:
+            hme.console, hme.sink = console, sink
+        flusher = asyncio.ensure_future(sink.autoflush())
+        try:
+            with console.status("[bold green]Generating iCloud email(s)..."):
+                results = await asyncio.gather(
+                    *(
+                        (hme._generate_scheduled if wait else hme._generate)(
+                            share, concurrency, reserve_concurrency
+                        )
+                        for hme, share in zip(accounts, shares)
+                    )
+                )
+        finally:
+            flusher.cancel()
+    generated = sum(len(emails) for emails in results)
+    if generated and output != "-":
+        console.rule()
+        console.log(f':star: Emails have been saved into the "{output}" file')
+    console.log(
+        f"[bold green]All done![/] Successfully generated [bold green]{generated}[/] "
+        f"email(s) across {len(accounts)} account(s)"
+    )
 
 
 async def list(
-    active: bool, search: str, label: Optional[str], notes: Optional[str]
+    active: bool,
+    search: Optional[str],
+    label: Optional[str],
+    notes: Optional[str],
+    refresh: bool = False,
+    fmt: str = "table",
+    **filters,
 ) -> None:
     async with RichHideMyEmail(label, notes) as hme:
-        await hme.list(active, search)
+        if fmt != "table":
+            # keep stdout for the rows
+            hme.console = Console(stderr=True)
+        await hme.list(active, search, refresh, fmt, **filters)
 
 
-async def delete(email: List[str]) -> None:
-    async with RichHideMyEmail("", "") as hme:
-        await hme.delete(email)
+async def delete(email: Iterable[str], concurrency: int = MAX_BULK_TASKS) -> None:
+    async with RichHideMyEmail("", "", concurrency=concurrency) as hme:
+        await hme.delete(email, concurrency)
 
 
-async def deactivate(email: List[str]) -> None:
-    async with RichHideMyEmail("", "") as hme:
-        await hme.deactivate(email)
+async def deactivate(email: Iterable[str], concurrency: int = MAX_BULK_TASKS) -> None:
+    async with RichHideMyEmail("", "", concurrency=concurrency) as hme:
+        await hme.deactivate(email, concurrency)
+
+
+async def reactivate(email: Iterable[str], concurrency: int = MAX_BULK_TASKS) -> None:
+    async with RichHideMyEmail("", "", concurrency=concurrency) as hme:
+        await hme.reactivate(email, concurrency)
 
 
-async def reactivate(email: List[str]) -> None:
+async def plan(path: str) -> None:
     async with RichHideMyEmail("", "") as hme:
-        await hme.reactivate(email)
+        await hme.plan(path)
+
+
+async def apply(path: str, concurrency: int = MAX_BULK_TASKS) -> None:
+    async with RichHideMyEmail("", "", concurrency=concurrency) as hme:
+        await hme.apply(path, concurrency)
+
+
+async def relabel(
+    label: Optional[str],
+    note: Optional[str],
+    filters: Dict[str, Any],
+    emails: Optional[Iterable[str]] = None,
+    concurrency: int = MAX_BULK_TASKS,
+    rate: Optional[float] = None,
+    failed_file: Optional[str] = None,
+) -> None:
+    async with RichHideMyEmail("", "", concurrency=concurrency) as hme:
+        if rate:
+            # start at and never exceed the requested rate, still backing off when throttled
+            hme.limiter = AdaptiveRateLimiter(rate=rate, max_rate=rate)
+        await hme.relabel(label, note, filters, emails, concurrency, failed_file)
+
+
+async def checkout(label: str, notes: Optional[str], count: int = 1) -> None:
+    async with RichHideMyEmail(label, notes) as hme:
+        # keep stdout for the emails
+        hme.console = Console(stderr=True)
+        for _ in range(count):
+            alias = await hme.checkout(label, notes)
+            if alias is None:
+                break
+            print(alias.hme, flush=True)
+        hme.console.log(f"{hme.reservoir.size} email(s) left in the reservoir")
+
+
+async def fill(high: int = POOL_HIGH) -> None:
+    async with RichHideMyEmail(POOL_LABEL, "") as hme:
+        hme.reservoir.high = high
+        with hme.console.status("[bold green]Filling the reservoir..."):
+            added = await hme.reservoir.fill()
+        hme.console.log(
+            f"[bold green]All done![/] Reserved [bold green]{added}[/] email(s), "
+            f"{hme.reservoir.size}/{high} in the reservoir"
+        )
 
 
 if __name__ == "__main__":
+    select_loop()
     loop = asyncio.new_event_loop()
     try:
         loop.run_until_complete(generate(None, None, None))
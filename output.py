@@ -0,0 +1,69 @@
+import csv
+import sys
+from typing import IO, Iterable, Optional
+
+from rich.table import Table
+from rich.box import MINIMAL_HEAVY_HEAD
+
+from icloud import codec
+from icloud.records import Alias
+
+FORMATS = ("table", "jsonl", "csv")
+LIST_FIELDS = ("hme", "label", "note", "created", "is_active", "anonymous_id")
+
+
+def alias_table(aliases: Iterable[Alias]) -> Table:
+    """Renders aliases as a rich table, one row each"""
+    table = Table(
+        box=MINIMAL_HEAVY_HEAD,
+        padding=(0, 0, 1, 0),  # top, right, bottom, and left borders
+    )
+    table.add_column("Label", no_wrap=True)
+    table.add_column("Notes")
+    table.add_column("Hide my email", no_wrap=True)
+    table.add_column("Created Date Time")
+    table.add_column("IsActive")
+    for alias in aliases:
+        table.add_row(
+            alias.label,
+            alias.note,
+            alias.hme,
+            str(alias.created),
+            str(alias.is_active),
+        )
+    return table
+
+
+def _record(alias: Alias) -> dict:
+    return {
+        "hme": alias.hme,
+        "label": alias.label,
+        "note": alias.note,
+        "created": alias.created.isoformat() if alias.create_timestamp else "",
+        "is_active": alias.is_active,
+        "anonymous_id": alias.anonymous_id or "",
+    }
+
+
+def write_aliases(
+    aliases: Iterable[Alias], fmt: str, stream: Optional[IO[str]] = None
+) -> int:
+    """Writes aliases as jsonl or csv one row at a time, without holding them all.
+
+    Returns the number of rows written.
+    """
+    stream = stream or sys.stdout
+    written = 0
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(LIST_FIELDS)
+        for alias in aliases:
+            record = _record(alias)
+            writer.writerow(record[field] for field in LIST_FIELDS)
+            written += 1
+    else:
+        for alias in aliases:
+            stream.write(codec.dumps(_record(alias)).decode() + "\n")
+            written += 1
+    stream.flush()
+    return written
@@ -0,0 +1,199 @@
+import http.client
+import json
+import os
+import socket
+from typing import Iterable, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+from rich.console import Console
+
+from icloud.records import Alias
+from icloud.sinks import open_sink
+from settings import DAEMON_TOKEN_ENVVAR, MAX_BULK_TASKS, MAX_CONCURRENT_TASKS
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DaemonClient:
+    def __init__(
+        self, url: str, timeout: Optional[float] = None, token: Optional[str] = None
+    ):
+        """Talks to a running `serve` over the standard library only.
+
+        The CLI calls this in tight loops, so it avoids importing aiohttp.
+
+        Args:
+            url (str)       http://host:port, or unix:/path/to/socket
+            timeout (float) Seconds to wait for a response, None waits as long as it takes
+            token (str)     The daemon's token, defaults to HME_DAEMON_TOKEN
+        """
+        self.url = url
+        self.timeout = timeout
+        self.token = token or os.getenv(DAEMON_TOKEN_ENVVAR)
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.url.startswith("unix:"):
+            return _UnixConnection(self.url[len("unix:") :], self.timeout)
+        parts = urlsplit(self.url)
+        return http.client.HTTPConnection(
+            parts.hostname or "127.0.0.1", parts.port, timeout=self.timeout
+        )
+
+    def _call(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        conn = self._connection()
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            conn.request(
+                method,
+                path,
+                body=None if body is None else json.dumps(body),
+                headers=headers,
+            )
+            return json.loads(conn.getresponse().read())
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            return {"error": 1, "reason": f"Daemon unreachable: {e}"}
+        finally:
+            conn.close()
+
+    def generate(
+        self, count: int, label: Optional[str], notes: Optional[str], **kwargs
+    ) -> dict:
+        return self._call(
+            "POST",
+            "/generate",
+            {"count": count, "label": label, "notes": notes, **kwargs},
+        )
+
+    def list(
+        self,
+        active: Optional[bool],
+        search: Optional[str],
+        refresh: bool = False,
+        **filters,
+    ) -> dict:
+        params = {"refresh": "1" if refresh else "0"}
+        if active is not None:
+            params["active"] = "1" if active else "0"
+        if search is not None:
+            params["search"] = search
+        params.update(
+            (key, str(value)) for key, value in filters.items() if value is not None
+        )
+        return self._call("GET", f"/list?{urlencode(params)}")
+
+    def checkout(self, label: str, notes: Optional[str]) -> dict:
+        return self._call("POST", "/checkout", {"label": label, "notes": notes})
+
+    def action(
+        self, name: str, emails: Iterable[str], concurrency: int = MAX_BULK_TASKS
+    ) -> dict:
+        return self._call(
+            "POST",
+            f"/{name}",
+            {"emails": [email for email in emails], "concurrency": concurrency},
+        )
+
+
+def _aliases(res: dict, console: Console) -> Optional[List[Alias]]:
+    if not res.get("success"):
+        console.log(f"[bold red][ERR][/] - Daemon: {res.get('reason', 'Unknown')}")
+        return None
+    return [Alias.from_json(row) for row in res["result"]["aliases"]]
+
+
+def remote_generate(
+    url: str,
+    count: int,
+    label: Optional[str],
+    notes: Optional[str],
+    concurrency: int = MAX_CONCURRENT_TASKS,
+    reserve_concurrency: int = MAX_CONCURRENT_TASKS,
+    output: str = "emails.txt",
+    fmt: str = "text",
+) -> None:
+    console = Console(stderr=output == "-")
+    with console.status("[bold green]Generating iCloud email(s)..."):
+        res = DaemonClient(url).generate(
+            count,
+            label,
+            notes,
+            concurrency=concurrency,
+            reserve_concurrency=reserve_concurrency,
+        )
+    aliases = _aliases(res, console)
+    if not aliases:
+        return
+    with open_sink(fmt, output) as sink:
+        for alias in aliases:
+            sink.write(alias)
+    if output != "-":
+        console.log(f':star: Emails have been saved into the "{output}" file')
+    console.log(
+        f"[bold green]All done![/] Successfully generated [bold green]{len(aliases)}[/] email(s)"
+    )
+
+
+def remote_list(
+    url: str,
+    active: bool,
+    search: Optional[str],
+    refresh: bool = False,
+    fmt: str = "table",
+    **filters,
+) -> None:
+    from output import alias_table, write_aliases
+
+    console = Console(stderr=fmt != "table")
+    # a text search matches active and inactive emails alike
+    if search is not None or filters.get("note") or filters.get("hme"):
+        active = None
+    res = DaemonClient(url).list(active, search, refresh, **filters)
+    aliases = _aliases(res, console)
+    if aliases is None:
+        return
+    if fmt == "table":
+        console.print(alias_table(aliases))
+    else:
+        write_aliases(aliases, fmt)
+
+
+def remote_checkout(url: str, label: str, notes: Optional[str], count: int = 1) -> None:
+    console = Console(stderr=True)
+    daemon = DaemonClient(url)
+    for _ in range(count):
+        aliases = _aliases(daemon.checkout(label, notes), console)
+        if not aliases:
+            break
+        print(aliases[0].hme, flush=True)
+
+
+def remote_action(
+    url: str, name: str, emails: Iterable[str], concurrency: int = MAX_BULK_TASKS
+) -> None:
+    console = Console()
+    with console.status(f"[bold green]{name.capitalize()}..."):
+        res = DaemonClient(url).action(name, emails, concurrency)
+    if not res.get("success"):
+        console.log(f"[bold red][ERR][/] - Daemon: {res.get('reason', 'Unknown')}")
+        return
+    result = res["result"]
+    for hme in result["failed"]:
+        console.log(f"[bold red][ERR][/] - Failed to {name} [italic][red]{hme}[/][/]")
+    skipped = result["skipped"]
+    console.log(
+        f"[bold green]All done![/] {name.capitalize()}: "
+        f"[bold green]{len(result['succeeded'])}[/] succeeded, "
+        f"[bold red]{len(result['failed'])}[/] failed, "
+        f"{skipped.get('duplicate', 0)} duplicate and {skipped.get('blank', 0)} blank line(s) skipped"
+    )
@@ -0,0 +1,47 @@
+"""Defaults and environment variable names.
+
+Kept free of third-party imports so `cli.py` can build its options without
+loading the HTTP stack.
+"""
+
+MAX_CONCURRENT_TASKS = 5
+# concurrent requests for delete, deactivate and reactivate
+MAX_BULK_TASKS = 10
+# stop generating after this many failures in a row
+MAX_FAILED_ATTEMPTS = 10
+# the reservoir is refilled once it is down to POOL_LOW, up to POOL_HIGH
+POOL_LOW = 5
+POOL_HIGH = 20
+# label pooled aliases carry until they are checked out
+POOL_LABEL = "hme reservoir"
+COOKIE_ENVVAR = "HME_COOKIE_ENVVAR"
+# browser to re-extract cookies from when iCloud rejects the cookie file
+COOKIE_BROWSER_ENVVAR = "HME_COOKIE_BROWSER"
+# overrides the iCloud host, e.g. to run against benchmarks/mock_server.py
+BASE_URL_ENVVAR = "HME_BASE_URL"
+# optional on-disk hme -> anonymousId index shared between runs
+INDEX_CACHE_ENVVAR = "HME_INDEX_CACHE"
+INDEX_TTL_ENVVAR = "HME_INDEX_TTL"
+# local SQLite copy of the account's aliases, answers `list` without a download
+INVENTORY_ENVVAR = "HME_INVENTORY"
+# append-only record of every generated and reserved email, used by --resume
+JOURNAL_ENVVAR = "HME_JOURNAL"
+
+# Apple's rolling quota, override if the account's limits differ
+WINDOW_QUOTA_ENVVAR = "HME_WINDOW_QUOTA"
+WINDOW_SECONDS_ENVVAR = "HME_WINDOW_SECONDS"
+
+# seconds an idle pooled connection is kept open for the next request
+KEEPALIVE_ENVVAR = "HME_KEEPALIVE"
+# seconds a resolved iCloud address is reused
+DNS_TTL_ENVVAR = "HME_DNS_TTL"
+
+# JSON codec and event loop, "auto" uses orjson / uvloop when installed
+JSON_ENVVAR = "HME_JSON"
+LOOP_ENVVAR = "HME_LOOP"
+
+# where the CLI finds a running `serve`, e.g. http://127.0.0.1:8765 or unix:/tmp/hme.sock
+DAEMON_ENVVAR = "HME_DAEMON"
+DEFAULT_PORT = 8765
+# shared secret `serve` expects in the Authorization header, generated when unset
+DAEMON_TOKEN_ENVVAR = "HME_DAEMON_TOKEN"